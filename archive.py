@@ -0,0 +1,286 @@
+"""Compressed, content-addressed archive of raw responses."""
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+
+# Configuration variables
+segmentSize = 256 * 1024 * 1024
+compressionLevel = 6
+
+# File names written by the former scrape.writeToFile helper; other files
+# in the data directory, such as metrics, are left alone
+legacyName = re.compile(
+    r"^(?P<prefix>exchanges|exchange_.+|price_volume_.+)"
+    r"_(?P<time>\d+)\.(?P<ext>html|json)$")
+
+
+class Archive(object):
+
+    """Append-only archive of compressed response bodies.
+
+    Bodies are stored once per SHA-1 of their content in segment files; an
+    SQLite index maps each fetch (prefix, extension, fetch time) to the
+    body's hash and the body's hash to its segment, offset and length.
+    """
+
+    def __init__(self, path):
+        """Open or create the archive in directory path."""
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.lock = threading.Lock()
+        self.index = sqlite3.connect(
+            os.path.join(path, "index.sqlite"), check_same_thread=False)
+        self.index.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                segment INTEGER,
+                offset INTEGER,
+                length INTEGER,
+                raw_length INTEGER);
+            CREATE TABLE IF NOT EXISTS responses (
+                prefix TEXT,
+                extension TEXT,
+                fetched_at INTEGER,
+                hash TEXT);
+            CREATE INDEX IF NOT EXISTS responses_prefix_fetched_at
+                ON responses (prefix, fetched_at);
+            """)
+        row = self.index.execute("SELECT MAX(segment) FROM blobs").fetchone()
+        self.segment = row[0] or 0
+        self.writer = None
+
+    def _segmentPath(self, segment):
+        """Private method returning the file name of a segment."""
+        return os.path.join(self.path, "segment_{0:06d}.dat".format(segment))
+
+    def _append(self, compressed):
+        """Private method appending bytes and returning their location."""
+        if self.writer is None:
+            self.writer = open(self._segmentPath(self.segment), 'ab')
+            self.writer.seek(0, os.SEEK_END)
+        if self.writer.tell() > 0 and \
+                self.writer.tell() + len(compressed) > segmentSize:
+            self.writer.close()
+            self.segment += 1
+            self.writer = open(self._segmentPath(self.segment), 'ab')
+        offset = self.writer.tell()
+        self.writer.write(compressed)
+        self.writer.flush()
+        return self.segment, offset
+
+    def put(self, content, prefix, extension, fetchedAt=None, commit=True):
+        """Store a response body and record the fetch; return its hash.
+
+        With commit=False the index is only committed by a later put or
+        commit call, which makes bulk imports much faster.
+        """
+        if fetchedAt is None:
+            fetchedAt = int(time.time())
+        raw = content.encode("utf-8")
+        digest = hashlib.sha1(raw).hexdigest()
+        with self.lock:
+            known = self.index.execute(
+                "SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if known is None:
+                compressed = zlib.compress(raw, compressionLevel)
+                segment, offset = self._append(compressed)
+                self.index.execute(
+                    "INSERT INTO blobs VALUES (?, ?, ?, ?, ?)",
+                    (digest, segment, offset, len(compressed), len(raw)))
+            self.index.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?)",
+                (prefix, extension, fetchedAt, digest))
+            if commit:
+                self.index.commit()
+        return digest
+
+    def commit(self):
+        """Commit pending index entries."""
+        with self.lock:
+            self.index.commit()
+
+    def get(self, digest):
+        """Return the body stored under a hash."""
+        with self.lock:
+            row = self.index.execute(
+                "SELECT segment, offset, length FROM blobs WHERE hash = ?",
+                (digest,)).fetchone()
+        if row is None:
+            raise KeyError(digest)
+        segment, offset, length = row
+        f = open(self._segmentPath(segment), 'rb')
+        f.seek(offset)
+        compressed = f.read(length)
+        f.close()
+        return zlib.decompress(compressed).decode("utf-8")
+
+    def find(self, prefix=None, since=None, until=None):
+        """List fetches as (prefix, extension, fetched_at, hash) tuples.
+
+        A prefix ending in % matches as a LIKE pattern.
+        """
+        conditions = []
+        params = []
+        if prefix is not None:
+            conditions.append(
+                "prefix LIKE ?" if prefix.endswith("%") else "prefix = ?")
+            params.append(prefix)
+        if since is not None:
+            conditions.append("fetched_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("fetched_at < ?")
+            params.append(until)
+        query = "SELECT prefix, extension, fetched_at, hash FROM responses"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        with self.lock:
+            return self.index.execute(
+                query + " ORDER BY prefix, fetched_at", params).fetchall()
+
+    def latest(self, prefix):
+        """Return the most recently fetched body for a prefix, or None."""
+        fetches = self.find(prefix)
+        if not fetches:
+            return None
+        return self.get(fetches[-1][3])
+
+    def close(self):
+        """Close the segment writer and the index."""
+        with self.lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            self.index.commit()
+            self.index.close()
+
+
+def lockWriter(path):
+    """Take the exclusive writer lock of an archive directory.
+
+    Returns the open lock file, which holds the lock until it is closed or
+    the process exits, or None if another process holds the lock.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    lockFile = open(os.path.join(path, "writer.lock"), 'w')
+    try:
+        fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        lockFile.close()
+        return None
+    return lockFile
+
+
+def migrate(dataDir, responseArchive, remove=False):
+    """Import files written by the old writeToFile helper into an archive.
+
+    Returns the number of files imported.
+    """
+    count = 0
+    imported = []
+    for fileName in sorted(os.listdir(dataDir)):
+        match = legacyName.match(fileName)
+        path = os.path.join(dataDir, fileName)
+        if match is None or not os.path.isfile(path):
+            continue
+        f = open(path, 'rb')
+        content = f.read().decode("utf-8")
+        f.close()
+        responseArchive.put(
+            content, match.group("prefix"), match.group("ext"),
+            int(match.group("time")), commit=False)
+        count += 1
+        imported.append(path)
+        if count % 1000 == 0:
+            _commitImported(responseArchive, imported, remove)
+    _commitImported(responseArchive, imported, remove)
+    return count
+
+
+def _commitImported(responseArchive, imported, remove):
+    """Private method committing imports before deleting their files."""
+    responseArchive.commit()
+    if remove:
+        for path in imported:
+            os.remove(path)
+    del imported[:]
+
+
+class ArchiveTest(unittest.TestCase):
+
+    """Testing suite for archive module."""
+
+    def setUp(self):
+        """Create a scratch directory."""
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the scratch directory."""
+        shutil.rmtree(self.path)
+
+    def testPutGet(self):
+        """Test storing, deduplicating and reading bodies."""
+        responseArchive = Archive(os.path.join(self.path, "archive"))
+        first = responseArchive.put(u"[1]", "price_volume_a", "json", 10)
+        second = responseArchive.put(u"[1]", "price_volume_a", "json", 20)
+        responseArchive.put(u"\xa0<html>", "exchanges", "html", 30)
+        self.assertEqual(first, second)
+        self.assertEqual(responseArchive.get(first), u"[1]")
+        self.assertEqual(responseArchive.latest("exchanges"), u"\xa0<html>")
+        self.assertEqual(
+            [fetch[2] for fetch in responseArchive.find("price_volume_%")],
+            [10, 20])
+        self.assertEqual(len(responseArchive.find(since=15, until=25)), 1)
+        responseArchive.close()
+        reopened = Archive(os.path.join(self.path, "archive"))
+        self.assertEqual(reopened.get(first), u"[1]")
+        self.assertEqual(
+            reopened.index.execute("SELECT COUNT(*) FROM blobs").fetchone(),
+            (2,))
+        reopened.close()
+
+    def testLockWriter(self):
+        """Test only one writer can hold an archive directory."""
+        path = os.path.join(self.path, "archive")
+        lockFile = lockWriter(path)
+        self.assertTrue(lockFile is not None)
+        self.assertTrue(lockWriter(path) is None)
+        lockFile.close()
+        other = lockWriter(path)
+        self.assertTrue(other is not None)
+        other.close()
+
+    def testMigrate(self):
+        """Test migrating legacy data files."""
+        for fileName in ["exchanges_100.html",
+                         "price_volume_usd_btc_btc-e_10d_1h_200.json",
+                         "http_validators.json",
+                         "metrics_worker_4242.prom",
+                         "metrics_1500.json"]:
+            f = open(os.path.join(self.path, fileName), 'w')
+            f.write("content")
+            f.close()
+        responseArchive = Archive(os.path.join(self.path, "archive"))
+        self.assertEqual(migrate(self.path, responseArchive, remove=True), 2)
+        self.assertEqual(responseArchive.find("price_volume_%")[0][:3], (
+            "price_volume_usd_btc_btc-e_10d_1h", "json", 200))
+        for fileName in ["http_validators.json", "metrics_worker_4242.prom",
+                         "metrics_1500.json"]:
+            self.assertTrue(os.path.exists(
+                os.path.join(self.path, fileName)))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.path, "exchanges_100.html")))
+        responseArchive.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,696 @@
+"""Benchmarks for parsing, loading and scraping cryptocoincharts data.
+
+Run "python bench.py [--output results.json]" to print one JSON record per
+benchmark, or "python bench.py --compare old.json new.json" to compare two
+result files.
+"""
+import collections
+import cryptocoincharts
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+exampleDir = "{0}/example".format(os.path.dirname(os.path.abspath(__file__)))
+priceVolumeFile = "price_volume_usd_btc_btc-e_alltime_1h.json"
+exchangesFile = "exchanges.html"
+exchangeFile = "exchange_btc-e.html"
+
+
+def _readExample(fileName):
+    """Private method reading a file from the example directory."""
+    f = open("{0}/{1}".format(exampleDir, fileName), 'r')
+    content = f.read()
+    f.close()
+    return content
+
+
+def _result(name, rows, seconds, **extra):
+    """Private method building a benchmark result record."""
+    result = {
+        "name": name,
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_sec": rows / seconds if seconds > 0 else None
+    }
+    result.update(extra)
+    return result
+
+
+def _best(func, repeat):
+    """Private method returning the fastest of several timed runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _peakMemory(func):
+    """Private method returning the peak bytes allocated by func.
+
+    Returns None where tracemalloc is not available.
+    """
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchParse(repeat=5):
+    """Measure rows/sec and peak memory of every parser."""
+    import frame
+    exchangesHtml = _readExample(exchangesFile)
+    exchangeHtml = _readExample(exchangeFile)
+    jsonDump = _readExample(priceVolumeFile)
+    priceVolumeRows = len(json.loads(jsonDump))
+
+    def parseStream():
+        # Read from the file, as from a response, so the peak memory is
+        # the parser's own rather than a copy of the whole dump
+        f = open("{0}/{1}".format(exampleDir, priceVolumeFile), 'rb')
+        try:
+            collections.deque(cryptocoincharts.iterPriceVolume(
+                f, "usd", "btc", "btc-e"), 0)
+        finally:
+            f.close()
+
+    parsers = [
+        ("parse_exchanges",
+            len(cryptocoincharts.parseExchanges(exchangesHtml)),
+            lambda: cryptocoincharts.parseExchanges(exchangesHtml)),
+        ("parse_exchange",
+            len(cryptocoincharts.parseExchange(exchangeHtml)[1]),
+            lambda: cryptocoincharts.parseExchange(exchangeHtml)),
+        ("parse_price_volume", priceVolumeRows,
+            lambda: cryptocoincharts.parsePriceVolume(
+                jsonDump, "usd", "btc", "btc-e")),
+        ("parse_price_volume_stream", priceVolumeRows, parseStream),
+        ("parse_price_volume_frame", priceVolumeRows,
+            lambda: frame.PriceVolumeFrame.fromJson(
+                jsonDump, "usd", "btc", "btc-e"))
+    ]
+    return [_result(name, rows, _best(parser, repeat),
+                    peak_bytes=_peakMemory(parser))
+            for name, rows, parser in parsers]
+
+
+def benchParsePool(jobs=32, processes=None):
+    """Measure pooled parse rows/sec for an increasing number of processes.
+
+    Every job parses the example dump from file, as when reprocessing an
+    archive of alltime dumps.
+    """
+    import multiprocessing
+    import parsepool
+    if processes is None:
+        processes = range(1, multiprocessing.cpu_count() + 1)
+    path = "{0}/{1}".format(exampleDir, priceVolumeFile)
+    rowsPerJob = len(json.loads(_readExample(priceVolumeFile)))
+    results = []
+    for count in processes:
+        with parsepool.ParsePool(count) as pool:
+            start = time.time()
+            for _ in pool.imapPriceVolumeFiles(
+                    [(path, "usd", "btc", "btc-e")] * jobs):
+                pass
+            elapsed = time.time() - start
+        results.append(_result(
+            "parse_pool_{0}".format(count), rowsPerJob * jobs, elapsed))
+    return results
+
+
+class StandInLoader(object):
+
+    """Embedded SQLite stand-in for pg.loadPriceVolume.
+
+    Used when no PostgreSQL server is reachable; it runs the same upsert
+    on the same columns, so numbers stay comparable between commits on
+    the same machine, though not with PostgreSQL.
+    """
+
+    def __init__(self, columns, keyColumns, valueColumns):
+        """Create the in-memory table."""
+        self.columns = columns
+        self.db = sqlite3.connect(":memory:", check_same_thread=False)
+        self.db.execute("CREATE TABLE exchange_pair_hour ({0}, \
+            UNIQUE ({1}))".format(", ".join(columns), ", ".join(keyColumns)))
+        self.query = "INSERT INTO exchange_pair_hour ({0}) VALUES ({1}) \
+            ON CONFLICT ({2}) DO UPDATE SET {3}".format(
+            ", ".join(columns), ", ".join("?" for _ in columns),
+            ", ".join(keyColumns),
+            ", ".join("{0} = excluded.{0}".format(column)
+                      for column in valueColumns))
+        self.lock = threading.Lock()
+
+    def load(self, data, mode=None):
+        """Upsert rows, records or a frame."""
+        if hasattr(data, "asDicts"):
+            data = data.asDicts()
+        rows = [tuple(datum[column] for column in self.columns)
+                for datum in data]
+        with self.lock:
+            self.db.executemany(self.query, rows)
+            self.db.commit()
+        return True
+
+    def truncate(self):
+        """Remove all rows."""
+        with self.lock:
+            self.db.execute("DELETE FROM exchange_pair_hour")
+            self.db.commit()
+
+    def close(self):
+        """Close the database."""
+        self.db.close()
+
+
+class PgBenchLoader(object):
+
+    """pg.loadPriceVolume redirected to a scratch copy of the target table."""
+
+    def __init__(self, pg):
+        """Create the scratch tables; raises if PostgreSQL is unreachable."""
+        self.pg = pg
+        self.targetTableOriginal = pg.targetTable
+        self.rollupTablesOriginal = pg.rollupTables
+        self.cursor = pg.dictCursor()
+        for table in [self.targetTableOriginal] + list(
+                self.rollupTablesOriginal.values()):
+            self.cursor.execute("""CREATE TABLE IF NOT EXISTS
+                {0}_bench (LIKE {0} INCLUDING ALL); COMMIT""".format(table))
+        pg.targetTable = "{0}_bench".format(self.targetTableOriginal)
+        pg.rollupTables = dict(
+            (unit, "{0}_bench".format(table))
+            for unit, table in self.rollupTablesOriginal.items())
+
+    def load(self, data, mode=None):
+        """Load through pg.loadPriceVolume."""
+        return self.pg.loadPriceVolume(data, mode=mode)
+
+    def truncate(self):
+        """Remove all rows."""
+        self.cursor.execute("TRUNCATE {0}; COMMIT".format(", ".join(
+            [self.pg.targetTable] + list(self.pg.rollupTables.values()))))
+
+    def close(self):
+        """Drop the scratch tables and restore the target tables."""
+        self.cursor.execute("DROP TABLE IF EXISTS {0}; COMMIT".format(
+            ", ".join([self.pg.targetTable] +
+                      list(self.pg.rollupTables.values()))))
+        self.pg.targetTable = self.targetTableOriginal
+        self.pg.rollupTables = self.rollupTablesOriginal
+
+
+# Columns of exchange_pair_hour, for the stand-in when pg cannot be imported
+_keyColumns = ["exchange", "source", "sink", "hour"]
+_valueColumns = [
+    "price_low", "price_25th_percentile", "price_75th_percentile",
+    "price_high", "price_median", "price_ema20", "volume",
+    "field_7", "field_8"]
+
+
+def _loader():
+    """Private method returning (backend, loader) for load benchmarks."""
+    try:
+        import pg
+        return "postgres", PgBenchLoader(pg)
+    except Exception:
+        return "sqlite", StandInLoader(
+            _keyColumns + _valueColumns, _keyColumns, _valueColumns)
+
+
+def benchLoadPriceVolume(repeat=3):
+    """Compare rows/sec of the load modes for inserts and full reloads."""
+    import frame
+    jsonDump = _readExample(priceVolumeFile)
+    data = cryptocoincharts.parsePriceVolume(jsonDump, "usd", "btc", "btc-e")
+    dataFrame = frame.PriceVolumeFrame.fromJson(
+        jsonDump, "usd", "btc", "btc-e")
+    backend, loader = _loader()
+    variants = [("copy", "copy", data), ("copy_frame", "copy", dataFrame)]
+    if backend == "postgres":
+        variants.insert(0, ("staging", "staging", data))
+        variants.append(("diff", "diff", data))
+    results = []
+    try:
+        for name, mode, rows in variants:
+            # Time a fresh load and a reload where every row conflicts
+            for phase in ("insert", "reload"):
+                best = None
+                for _ in range(repeat):
+                    if phase == "insert":
+                        loader.truncate()
+                    start = time.time()
+                    loader.load(rows, mode=mode)
+                    elapsed = time.time() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                results.append(_result(
+                    "load_{0}_{1}".format(name, phase), len(rows), best,
+                    backend=backend))
+    finally:
+        loader.close()
+    return results
+
+
+# Indexes of the unpartitioned layout in sql/create.sql
+_flatIndexes = [
+    "UNIQUE INDEX ON {0} (exchange, source, sink, hour)",
+    "INDEX ON {0} (source, sink, hour)",
+    "INDEX ON {0} (sink, hour)",
+    "INDEX ON {0} (exchange, hour)"]
+
+# Queries timed against both layouts: one pair over a range, and every
+# pair over a range
+_layoutQueries = [
+    ("pair_range", """SELECT * FROM {0}
+        WHERE exchange = 'bench-0' AND source = 'usd' AND sink = 'btc'
+        AND hour >= '2014-07-12' AND hour < '2014-07-22'"""),
+    ("time_range", """SELECT exchange, avg(price_median) FROM {0}
+        WHERE hour >= '2014-07-12' AND hour < '2014-07-22'
+        GROUP BY exchange""")]
+
+
+def benchPartitioning(pairs=20, repeat=3):
+    """Compare inserts and queries on the flat and partitioned layouts.
+
+    Loads the example dump as pairs different exchanges into scratch
+    tables, with rollups off so only the layout differs. Needs PostgreSQL
+    11+ and returns no results without it.
+    """
+    import frame
+    try:
+        import pg
+        cursor = pg.dictCursor()
+    except Exception:
+        return []
+    dataFrame = frame.PriceVolumeFrame.fromJson(
+        _readExample(priceVolumeFile), "usd", "btc", "btc-e")
+    frames = [frame.PriceVolumeFrame(
+        "usd", "btc", "bench-{0}".format(pairNum), dataFrame.hour,
+        dataFrame.columns) for pairNum in range(pairs)]
+    rows = len(dataFrame) * pairs
+    settings = (pg.targetTable, pg.partitioned, pg.rollupTables)
+    pg.rollupTables = {}
+    results = []
+    try:
+        for layout, partitioned in (("flat", False), ("partitioned", True)):
+            table = "{0}_bench_{1}".format(settings[0], layout)
+            cursor.execute("DROP TABLE IF EXISTS {0} CASCADE; COMMIT".format(
+                table))
+            if partitioned:
+                pg.createPartitionedTable(table, settings[0])
+            else:
+                cursor.execute("CREATE TABLE {0} (LIKE {1})".format(
+                    table, settings[0]))
+                for index in _flatIndexes:
+                    cursor.execute("CREATE " + index.format(table))
+                cursor.execute("COMMIT")
+            pg.targetTable, pg.partitioned = table, partitioned
+
+            # Time a fresh load and a reload where every row conflicts
+            for phase in ("insert", "reload"):
+                start = time.time()
+                for pairFrame in frames:
+                    pg.loadPriceVolume(pairFrame)
+                results.append(_result(
+                    "load_{0}_{1}".format(layout, phase), rows,
+                    time.time() - start, backend="postgres"))
+            cursor.execute("ANALYZE {0}; COMMIT".format(table))
+
+            for name, query in _layoutQueries:
+                fetched = []
+
+                def runQuery():
+                    cursor.execute(query.format(table))
+                    fetched[:] = cursor.fetchall()
+                    cursor.execute("COMMIT")
+                best = _best(runQuery, repeat)
+                results.append(_result(
+                    "query_{0}_{1}".format(layout, name), len(fetched), best,
+                    backend="postgres"))
+            cursor.execute("DROP TABLE {0} CASCADE; COMMIT".format(table))
+    finally:
+        pg.targetTable, pg.partitioned, pg.rollupTables = settings
+    return results
+
+
+def benchParallelLoad(pairs=20, workers=(1, 2, 4)):
+    """Measure rows/sec of pg.loadPriceVolumeParallel per worker count.
+
+    Loads the example dump as pairs different exchanges into scratch
+    tables. Needs PostgreSQL and returns no results without it.
+    """
+    import frame
+    try:
+        import pg
+        loader = PgBenchLoader(pg)
+    except Exception:
+        return []
+    dataFrame = frame.PriceVolumeFrame.fromJson(
+        _readExample(priceVolumeFile), "usd", "btc", "btc-e")
+    frames = [frame.PriceVolumeFrame(
+        "usd", "btc", "bench-{0}".format(pairNum), dataFrame.hour,
+        dataFrame.columns) for pairNum in range(pairs)]
+    results = []
+    try:
+        for workerCount in workers:
+            loader.truncate()
+            start = time.time()
+            for data, result, error in pg.loadPriceVolumeParallel(
+                    frames, workerCount):
+                if error is not None:
+                    raise error
+            results.append(_result(
+                "load_parallel_{0}".format(workerCount),
+                len(dataFrame) * pairs, time.time() - start,
+                backend="postgres"))
+    finally:
+        loader.close()
+    return results
+
+
+def benchReadPriceVolume(repeat=5):
+    """Compare reading one pair's history via dictCursor and readPriceVolume.
+
+    Needs PostgreSQL and returns no results without it.
+    """
+    import frame
+    try:
+        import pg
+        loader = PgBenchLoader(pg)
+    except Exception:
+        return []
+    dataFrame = frame.PriceVolumeFrame.fromJson(
+        _readExample(priceVolumeFile), "usd", "btc", "btc-e")
+    results = []
+    try:
+        loader.load(dataFrame)
+
+        def readDicts():
+            loader.cursor.execute("""SELECT * FROM {0}
+                WHERE exchange = 'btc-e' AND source = 'usd' AND sink = 'btc'
+                ORDER BY hour""".format(pg.targetTable))
+            loader.cursor.fetchall()
+            loader.cursor.execute("COMMIT")
+
+        def readCold():
+            pg.invalidateReadCache()
+            pg.readPriceVolume("btc-e", "usd", "btc")
+
+        def readCached():
+            pg.readPriceVolume("btc-e", "usd", "btc")
+
+        for name, func in (("read_dict_cursor", readDicts),
+                           ("read_columnar", readCold),
+                           ("read_columnar_cached", readCached)):
+            results.append(_result(
+                name, len(dataFrame), _best(func, repeat),
+                backend="postgres"))
+    finally:
+        pg.invalidateReadCache()
+        loader.close()
+    return results
+
+
+def benchStartup(repeat=5):
+    """Measure the start-up time of short-lived command line processes.
+
+    Runs each command in a fresh interpreter and reports the fastest wall
+    time, starting with a bare interpreter as the baseline. The parse
+    command parses a 240 row dump, the size of an incremental fetch.
+    """
+    rootDir = os.path.dirname(os.path.abspath(__file__))
+    cliFile = os.path.join(rootDir, "cli.py")
+    path = tempfile.mkdtemp()
+    dumpFile = os.path.join(path, "price_volume_usd_btc_btc-e_10d_1h.json")
+    f = open(dumpFile, 'w')
+    f.write(json.dumps(json.loads(_readExample(priceVolumeFile))[-240:]))
+    f.close()
+    commands = [
+        ("startup_python", ["-c", "pass"]),
+        ("startup_import_cryptocoincharts",
+         ["-c", "import cryptocoincharts"]),
+        ("startup_import_pg", ["-c", "import pg"]),
+        ("startup_cli_help", [cliFile, "--help"]),
+        ("startup_cli_parse", [cliFile, "parse", dumpFile])]
+    results = []
+    devnull = open(os.devnull, 'w')
+    try:
+        for name, args in commands:
+            best = _best(lambda: subprocess.check_call(
+                [sys.executable] + args, cwd=rootDir, stdout=devnull,
+                stderr=devnull), repeat)
+            results.append(_result(name, 1, best))
+    finally:
+        devnull.close()
+        shutil.rmtree(path)
+    return results
+
+
+def stubServer(bodies=None, faults=None, errorRate=0.0, delay=0.0,
+               seed=0):
+    """Start a local HTTP server standing in for cryptocoincharts.info.
+
+    bodies maps URL paths to response bodies and defaults to the example
+    files; paths ending in / match every path below them. The first
+    requests are answered with the (status, headers) pairs in faults,
+    later ones fail with a 503 at errorRate, and every response is
+    delayed by delay seconds.
+    """
+    try:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        from SocketServer import ThreadingMixIn
+    except ImportError:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+
+    if bodies is None:
+        bodies = {
+            "/v2/markets/info": _readExample(exchangesFile),
+            "/v2/markets/show/": _readExample(exchangeFile),
+            "/v2/fast/period.php": _readExample(priceVolumeFile)
+        }
+
+    faults = list(faults or [])
+    faultsLock = threading.Lock()
+    generator = random.Random(seed)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _fault(self):
+            with faultsLock:
+                if faults:
+                    return faults.pop(0)
+                if generator.random() < errorRate:
+                    return (503, {})
+            return None
+
+        def do_GET(self):
+            if delay:
+                time.sleep(delay)
+            fault = self._fault()
+            if fault is not None:
+                status, headers = fault
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            path = self.path.split("?")[0]
+            if path not in bodies:
+                path = path[:path.rfind("/") + 1]
+            body = bodies.get(path)
+            if body is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = Server(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def benchScrape(pairs=20, errorRate=0.0, delay=0.0):
+    """Time a scrape.py-style run against a local stub of the site.
+
+    Fetches the exchange list and every exchange page, then fetches,
+    archives, parses and loads price / volume data for the first pairs.
+    The stub fails errorRate of the requests and delays every response.
+    """
+    import archive
+    import pipeline
+    server = stubServer(errorRate=errorRate, delay=delay)
+    archivePath = tempfile.mkdtemp()
+    responseArchive = archive.Archive(archivePath)
+    backend, loader = _loader()
+    settings = (cryptocoincharts.baseUrl, cryptocoincharts.interReqTime,
+                cryptocoincharts.burstSize, cryptocoincharts.backoffBase,
+                cryptocoincharts.maxRate)
+    cryptocoincharts.baseUrl = "http://127.0.0.1:{0}".format(
+        server.server_port)
+    cryptocoincharts.interReqTime = 0.0001
+    cryptocoincharts.burstSize = cryptocoincharts.maxInFlight
+    cryptocoincharts.backoffBase = 0.01
+    cryptocoincharts.maxRate = 1.0 / cryptocoincharts.interReqTime
+    requestedBefore = cryptocoincharts.countRequested
+    rows = []
+
+    def fetchStage(params):
+        return params, cryptocoincharts.requestPriceVolume(*params)
+
+    def archiveStage(item):
+        responseArchive.put(item[1], "price_volume_{0}".format(
+            "_".join(item[0])), "json")
+        return item
+
+    def parseStage(item):
+        params, jsonDump = item
+        return cryptocoincharts.parsePriceVolume(
+            jsonDump, params[0], params[1], params[2])
+
+    def loadStage(priceVolume):
+        loader.load(priceVolume)
+        rows.append(len(priceVolume))
+
+    try:
+        start = time.time()
+        exchanges = cryptocoincharts.parseExchanges(
+            cryptocoincharts.requestExchanges())
+        paramsList = []
+        for args, html, error in cryptocoincharts.requestBatch(
+                cryptocoincharts.requestExchange,
+                [(exchange["short_name"],) for exchange in exchanges]):
+            for pair in cryptocoincharts.parseExchange(html)[1]:
+                paramsList.append((pair["source"], pair["sink"],
+                                   args[0], "alltime", "1h"))
+        stats = pipeline.Pipeline([
+            pipeline.Stage("fetch", fetchStage, cryptocoincharts.maxInFlight),
+            pipeline.Stage("archive", archiveStage),
+            pipeline.Stage("parse", parseStage),
+            pipeline.Stage("load", loadStage)
+        ]).run(paramsList[:pairs])
+        elapsed = time.time() - start
+    finally:
+        (cryptocoincharts.baseUrl, cryptocoincharts.interReqTime,
+         cryptocoincharts.burstSize, cryptocoincharts.backoffBase,
+         cryptocoincharts.maxRate) = settings
+        server.shutdown()
+        server.server_close()
+        responseArchive.close()
+        shutil.rmtree(archivePath)
+        loader.close()
+    return [_result(
+        "scrape_end_to_end_faults" if errorRate else "scrape_end_to_end",
+        sum(rows), elapsed, backend=backend, error_rate=errorRate,
+        requests=cryptocoincharts.countRequested - requestedBefore,
+        stages=stats)]
+
+
+def environment():
+    """Describe the code and machine the benchmarks ran on."""
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode(
+            "ascii").strip()
+    except Exception:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.node(),
+        "timestamp": datetime.datetime.utcnow().strftime(
+            "%Y-%m-%dT%H:%M:%SZ")
+    }
+
+
+def runAll():
+    """Run every benchmark and tag the results with the environment."""
+    results = benchParse() + benchParsePool() + benchLoadPriceVolume() + \
+        benchPartitioning() + benchParallelLoad() + \
+        benchReadPriceVolume() + benchScrape() + \
+        benchScrape(errorRate=0.1) + benchStartup()
+    env = environment()
+    for result in results:
+        result.update(env)
+    return results
+
+
+def readResults(path):
+    """Read benchmark records written with --output."""
+    f = open(path, 'r')
+    results = [json.loads(line) for line in f if line.strip()]
+    f.close()
+    return results
+
+
+def compareResults(old, new):
+    """Return (name, old rows/sec, new rows/sec, ratio) per benchmark."""
+    oldRates = dict((result["name"], result["rows_per_sec"])
+                    for result in old)
+    comparison = []
+    for result in new:
+        oldRate = oldRates.get(result["name"])
+        newRate = result["rows_per_sec"]
+        ratio = newRate / oldRate if oldRate and newRate else None
+        comparison.append((result["name"], oldRate, newRate, ratio))
+    return comparison
+
+if __name__ == "__main__":
+    if "--compare" in sys.argv:
+        position = sys.argv.index("--compare")
+        for name, oldRate, newRate, ratio in compareResults(
+                readResults(sys.argv[position + 1]),
+                readResults(sys.argv[position + 2])):
+            print("{0:<32} {1:>14} {2:>14} {3:>8}".format(
+                name,
+                "{0:.0f}".format(oldRate) if oldRate else "-",
+                "{0:.0f}".format(newRate) if newRate else "-",
+                "{0:.2f}x".format(ratio) if ratio else "-"))
+    else:
+        output = None
+        if "--output" in sys.argv:
+            output = open(sys.argv[sys.argv.index("--output") + 1], 'a')
+        for result in runAll():
+            line = json.dumps(result, sort_keys=True)
+            print(line)
+            if output is not None:
+                output.write(line + "\n")
+        if output is not None:
+            output.close()
@@ -0,0 +1,173 @@
+"""Command line entry point for scraping, parsing, loading and replaying.
+
+Every subcommand imports what it needs when it runs, so a parse-only
+invocation starts without requests, psycopg2, numpy or a .pgpass file.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import unittest
+
+dataDir = "{0}/data".format(os.path.dirname(os.path.abspath(__file__)))
+archiveDir = "{0}/archive".format(dataDir)
+
+
+def _readFile(path):
+    """Private method returning the contents of a file."""
+    f = open(path, 'r')
+    content = f.read()
+    f.close()
+    return content
+
+
+def _priceVolumeParams(path):
+    """Private method returning (source, sink, exchange) of a dump file.
+
+    Files are named like the archive prefixes, e.g.
+    price_volume_usd_btc_btc-e_alltime_1h.json.
+    """
+    import replay
+    params = replay.parsePrefix(
+        os.path.splitext(os.path.basename(path))[0])
+    if params is None:
+        raise ValueError("Not a price / volume dump: {0}".format(path))
+    return params[:3]
+
+
+def parseFile(path):
+    """Parse a saved exchange list, exchange page or price / volume dump."""
+    import cryptocoincharts
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name == "exchanges":
+        return cryptocoincharts.parseExchanges(_readFile(path))
+    elif name.startswith("exchange_"):
+        summary, pairs = cryptocoincharts.parseExchange(_readFile(path))
+        return {"summary": summary, "pairs": pairs}
+    return cryptocoincharts.parsePriceVolume(
+        _readFile(path), *_priceVolumeParams(path))
+
+
+def runScrape(args):
+    """Run a full scrape, optionally within a budget."""
+    import scrape
+    scrape.main(args.budget_seconds, args.budget_requests)
+
+
+def runParse(args):
+    """Print every parsed file as one JSON line."""
+    for path in args.files:
+        sys.stdout.write(json.dumps(
+            {"file": path, "data": parseFile(path)}, default=str) + "\n")
+
+
+def runLoad(args):
+    """Parse price / volume dumps and load them over pooled connections."""
+    import frame
+    import pg
+    frames = [
+        frame.PriceVolumeFrame.fromJson(
+            _readFile(path), *_priceVolumeParams(path))
+        for path in args.files]
+    failed = 0
+    for data, result, error in pg.loadPriceVolumeParallel(
+            frames, args.workers, args.mode):
+        if error is not None:
+            failed += 1
+            logging.error("Failed to load {0}-{1}-{2}: {3}".format(
+                data.exchange, data.source, data.sink, error))
+    pg.closePool()
+    logging.info("Loaded {0} of {1} dumps.".format(
+        len(frames) - failed, len(frames)))
+    return 1 if failed else 0
+
+
+def runReplay(args):
+    """Reload archived or legacy dumps without the network."""
+    import replay
+    if args.legacy:
+        replay.replayLegacy(args.path or dataDir, args.processes)
+    else:
+        replay.replayArchive(args.path or archiveDir, args.processes)
+
+
+def parser():
+    """Return the argument parser for every subcommand."""
+    argumentParser = argparse.ArgumentParser(description=__doc__.split(
+        "\n")[0])
+    subparsers = argumentParser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    scrapeParser = subparsers.add_parser("scrape", help=runScrape.__doc__)
+    scrapeParser.add_argument("--budget-seconds", type=float, default=None)
+    scrapeParser.add_argument("--budget-requests", type=int, default=None)
+    scrapeParser.set_defaults(func=runScrape)
+
+    parseParser = subparsers.add_parser("parse", help=runParse.__doc__)
+    parseParser.add_argument("files", nargs="+")
+    parseParser.set_defaults(func=runParse)
+
+    loadParser = subparsers.add_parser("load", help=runLoad.__doc__)
+    loadParser.add_argument("files", nargs="+")
+    loadParser.add_argument("--workers", type=int, default=None)
+    loadParser.add_argument(
+        "--mode", choices=["diff", "copy", "staging"], default=None)
+    loadParser.set_defaults(func=runLoad)
+
+    replayParser = subparsers.add_parser("replay", help=runReplay.__doc__)
+    replayParser.add_argument("path", nargs="?", default=None)
+    replayParser.add_argument("--legacy", action="store_true")
+    replayParser.add_argument("--processes", type=int, default=None)
+    replayParser.set_defaults(func=runReplay)
+    return argumentParser
+
+
+def main(argv=None):
+    """Run the subcommand named on the command line."""
+    args = parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s:%(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S %p')
+    return args.func(args) or 0
+
+
+class CliTest(unittest.TestCase):
+
+    """Testing suite for cli module."""
+
+    def setUp(self):
+        """Locate the example files."""
+        self.exampleDir = "{0}/example".format(
+            os.path.dirname(os.path.abspath(__file__)))
+
+    def testParse(self):
+        """Test parse output and the modules it leaves unloaded."""
+        output = subprocess.check_output([
+            sys.executable, "-c",
+            "import cli, json, sys; cli.main(sys.argv[1:]); sys.stdout.write("
+            "json.dumps(sorted(module for module in ('requests', "
+            "'lxml', 'numpy', 'psycopg2') "
+            "if module in sys.modules)))",
+            "parse", os.path.join(
+                self.exampleDir, "price_volume_usd_btc_btc-e_alltime_1h.json")
+        ], cwd=os.path.dirname(os.path.abspath(__file__)))
+        lines = output.decode("utf-8").splitlines()
+        self.assertEqual(len(lines), 2)
+        parsed = json.loads(lines[0])
+        self.assertEqual(len(parsed["data"]), 9229)
+        self.assertEqual(parsed["data"][0]["hour"], "2013-06-26 22:00:00")
+        self.assertEqual(json.loads(lines[1]), [])
+
+    def testParseFile(self):
+        """Test parseFile picks the parser from the file name."""
+        self.assertTrue(len(parseFile(os.path.join(
+            self.exampleDir, "exchange_btc-e.html"))["pairs"]) > 0)
+        self.assertTrue(len(parseFile(os.path.join(
+            self.exampleDir, "exchanges.html"))) > 0)
+        self.assertRaises(ValueError, _priceVolumeParams, "dump.json")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,41 +1,478 @@
 """Module for scraping and parsing data from cryptocoincharts.info."""
 from datetime import date
 from datetime import datetime
+import codecs
+import hashlib
 import json
 import logging
-import lxml.html
-import requests
+import metrics
 import os
-from random import random
+import random
 import re
+import shutil
+import tempfile
+import threading
 import time
 import unittest
 
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
 baseUrl = "http://www.cryptocoincharts.info"
 countRequested = 0
+countNotModified = 0
 interReqTime = 2
-lastReqTime = None
+burstSize = 2
+maxInFlight = 4
+
+# Adaptive rate control per host. The request rate starts at
+# 1 / interReqTime, grows by rateIncrease requests per second after every
+# healthy response and is multiplied by rateDecrease after a 429, a 5xx,
+# a connection error or a response slower than slowResponseSeconds.
+minRate = 0.05
+maxRate = 5.0
+rateIncrease = 0.05
+rateDecrease = 0.5
+slowResponseSeconds = 10.0
+
+# Failed requests are retried with jittered exponential backoff, waiting
+# at least as long as a Retry-After header asks. A Retry-After longer than
+# backoffCap fails the request instead of stalling the run.
+maxRetries = 4
+backoffBase = 1.0
+backoffCap = 60.0
+requestTimeout = 60
+retryStatuses = (429, 500, 502, 503, 504)
+
+# Request accounting and per-host rate limiting state
+_countLock = threading.Lock()
+_buckets = {}
+_controllers = {}
+_bucketsLock = threading.Lock()
+
+
+class RequestError(Exception):
+
+    """Request answered with an unexpected status code."""
+
+    def __init__(self, statusCode):
+        """Record the status code."""
+        Exception.__init__(self, "Could not process request. \
+            Received status code {0}.".format(statusCode))
+        self.statusCode = statusCode
+
+# Bodies of responses to these small endpoints are cached with their
+# validators. Other responses, such as price / volume dumps, only keep the
+# hash of their body and are read back from bodyArchive on a 304.
+cachedBodyEndpoints = ("v2/markets/",)
+bodyArchive = None
+
+# Pooled HTTP session and cached validators / bodies keyed by URL
+_session = None
+_sessionLock = threading.Lock()
+_validators = {}
+_validatorsLock = threading.Lock()
+
+
+class TokenBucket(object):
+
+    """Token bucket limiting the request rate against a single host."""
+
+    def __init__(self, rate, capacity):
+        """Create a bucket refilling at rate tokens per second."""
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.lastFill = time.time()
+        self.pausedUntil = 0.0
+        self.lock = threading.Lock()
+
+    def _fill(self, now):
+        """Private method adding the tokens earned since the last fill."""
+        if now > self.lastFill:
+            self.tokens = min(
+                self.capacity,
+                self.tokens + (now - self.lastFill) * self.rate)
+            self.lastFill = now
+
+    def consume(self, tokens=1):
+        """Block until tokens are available and return the time slept."""
+        slept = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                if now < self.pausedUntil:
+                    timeToSleep = self.pausedUntil - now
+                else:
+                    self._fill(now)
+                    if self.tokens >= tokens:
+                        self.tokens -= tokens
+                        return slept
+                    timeToSleep = (tokens - self.tokens) / self.rate
+            time.sleep(timeToSleep)
+            slept += timeToSleep
+
+    def setRate(self, rate):
+        """Change the refill rate, keeping the tokens earned so far."""
+        with self.lock:
+            self._fill(time.time())
+            self.rate = float(rate)
+
+    def pause(self, seconds):
+        """Hand out no tokens for the next seconds."""
+        with self.lock:
+            self.pausedUntil = max(self.pausedUntil, time.time() + seconds)
+            self.tokens = 0.0
+            self.lastFill = self.pausedUntil
+
+
+class AdaptiveRate(object):
+
+    """AIMD controller for the rate of a host's token bucket."""
+
+    def __init__(self, bucket):
+        """Control the given bucket."""
+        self.bucket = bucket
+        self.lock = threading.Lock()
+        self.lastDecrease = 0.0
+
+    def record(self, healthy, sentAt):
+        """Adjust the rate for a response to a request sent at sentAt.
+
+        Requests sent before the last decrease report congestion that was
+        already acted on, so they cannot cut the rate again. Returns the
+        new rate.
+        """
+        with self.lock:
+            rate = self.bucket.rate
+            if healthy:
+                rate = min(maxRate, rate + rateIncrease)
+            elif sentAt >= self.lastDecrease:
+                self.lastDecrease = time.time()
+                rate = max(minRate, rate * rateDecrease)
+                logging.info("Reduced request rate to {0:.2f}/s.".format(
+                    rate))
+            self.bucket.setRate(rate)
+            return rate
+
+
+def _bucket(host):
+    """Private method returning the token bucket for a host."""
+    with _bucketsLock:
+        if host not in _buckets:
+            _buckets[host] = TokenBucket(1.0 / interReqTime, burstSize)
+        return _buckets[host]
+
+
+def _controller(host):
+    """Private method returning the rate controller for a host."""
+    bucket = _bucket(host)
+    with _bucketsLock:
+        if host not in _controllers:
+            _controllers[host] = AdaptiveRate(bucket)
+        return _controllers[host]
+
+
+def _requests():
+    """Private method importing requests on first use.
+
+    requests takes longer to import than the rest of this module, and
+    processes that only parse never need it.
+    """
+    import requests
+    return requests
+
+
+def _getSession():
+    """Private method returning the shared keep-alive session."""
+    global _session
+    requests = _requests()
+    with _sessionLock:
+        if _session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=maxInFlight, pool_maxsize=maxInFlight)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({"Accept-Encoding": "gzip, deflate"})
+            _session = session
+        return _session
+
+
+def _cachesBody(url):
+    """Private method returning whether a URL's body is kept in memory."""
+    return urlparse(url).path.lstrip("/").startswith(cachedBodyEndpoints)
+
+
+def loadValidators(path):
+    """Load cached ETag / Last-Modified validators from a file."""
+    if not os.path.exists(path):
+        return
+    f = open(path, 'r')
+    validators = json.load(f)
+    f.close()
+    # Drop bodies older files kept for every endpoint
+    validators = dict(
+        (url, validator) for url, validator in validators.items()
+        if "body" not in validator or _cachesBody(url))
+    with _validatorsLock:
+        _validators.update(validators)
+
+
+def saveValidators(path):
+    """Save cached ETag / Last-Modified validators to a file."""
+    with _validatorsLock:
+        validators = dict(_validators)
+    f = open(path, 'w')
+    json.dump(validators, f)
+    f.close()
+
+
+def _endpoint(urlPostfix):
+    """Private method naming the endpoint of a request for metrics."""
+    return "/".join(urlPostfix.split("/")[:3])
+
+
+def _recordResponse(urlPostfix, r, elapsed):
+    """Private method recording latency, status and size of a response."""
+    endpoint = _endpoint(urlPostfix)
+    metrics.observe("request_seconds", elapsed, endpoint=endpoint)
+    metrics.count("requests", endpoint=endpoint, status=r.status_code)
+    if "Content-Length" in r.headers:
+        metrics.count("request_bytes", int(r.headers["Content-Length"]),
+                      endpoint=endpoint)
+
+
+def _throttle(url, urlPostfix):
+    """Private method waiting for the host's rate limit before a request."""
+    timeSlept = _bucket(urlparse(url).netloc).consume()
+    metrics.observe("throttle_sleep_seconds", timeSlept)
+    if timeSlept > 0:
+        logging.info("Slept for {0} seconds before request.".format(
+            timeSlept))
+    logging.info("Issuing request for the following payload: {0}".format(
+        urlPostfix))
+
+
+def _retryAfter(r):
+    """Private method returning the seconds a Retry-After header asks for."""
+    value = r.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        from email.utils import mktime_tz, parsedate_tz
+        parsed = parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(0.0, mktime_tz(parsed) - time.time())
+
+
+def _backoff(attempt, retryAfter=None):
+    """Private method returning the delay before retry number attempt."""
+    delay = random.uniform(0, min(backoffCap, backoffBase * 2 ** attempt))
+    if retryAfter is not None:
+        delay = max(delay, retryAfter)
+    return delay
+
+
+def _get(urlPostfix, params, headers=None, stream=False):
+    """Private method issuing a throttled GET, retrying transient failures.
+
+    Connection errors and retryStatuses are retried up to maxRetries
+    times; every outcome feeds the host's rate controller. Returns the
+    final response, or raises the last error.
+    """
+    global countRequested
+    requests = _requests()
+    url = "{0}/{1}".format(baseUrl, urlPostfix)
+    controller = _controller(urlparse(url).netloc)
+    for attempt in range(maxRetries + 1):
+        _throttle(url, urlPostfix)
+        start = time.time()
+        retryAfter = None
+        try:
+            r = _getSession().get(url, params=params, headers=headers,
+                                  stream=stream, timeout=requestTimeout)
+        except requests.RequestException as e:
+            controller.record(False, start)
+            metrics.count("requests", endpoint=_endpoint(urlPostfix),
+                          status="error")
+            error = e
+        else:
+            elapsed = time.time() - start
+            _recordResponse(urlPostfix, r, elapsed)
+            with _countLock:
+                countRequested += 1
+            if r.status_code not in retryStatuses:
+                controller.record(elapsed <= slowResponseSeconds, start)
+                return r
+            controller.record(False, start)
+            retryAfter = _retryAfter(r)
+            error = RequestError(r.status_code)
+            r.close()
+        if attempt == maxRetries or (
+                retryAfter is not None and retryAfter > backoffCap):
+            raise error
+        if retryAfter is not None:
+            controller.bucket.pause(retryAfter)
+        delay = _backoff(attempt, retryAfter)
+        metrics.count("request_retries", endpoint=_endpoint(urlPostfix))
+        logging.warning("Retrying {0} in {1:.1f} seconds after: {2}".format(
+            urlPostfix, delay, error))
+        time.sleep(delay)
+
+
+def _cachedBody(cached):
+    """Private method returning the body a 304 refers to, None if lost."""
+    if "body" in cached:
+        return cached["body"]
+    try:
+        return bodyArchive.get(cached["hash"])
+    except KeyError:
+        return None
 
 
 def _request(urlPostfix, params={}):
     """Private method for requesting an arbitrary query string."""
-    global countRequested
-    global lastReqTime
-    if lastReqTime is not None and time.time() - lastReqTime < interReqTime:
-        timeToSleep = random()*(interReqTime-time.time()+lastReqTime)*2
-        logging.info("Sleeping for {0} seconds before request.".format(
-            timeToSleep))
-        time.sleep(timeToSleep)
-    logging.info("Issuing request for the following payload: {0}".format(
-        urlPostfix))
-    r = requests.get("{0}/{1}".format(baseUrl, urlPostfix), params=params)
-    lastReqTime = time.time()
-    countRequested += 1
-    if r.status_code == requests.codes.ok:
+    global countNotModified
+    requests = _requests()
+    url = "{0}/{1}".format(baseUrl, urlPostfix)
+    cacheKey = requests.Request("GET", url, params=params).prepare().url
+    with _validatorsLock:
+        cached = _validators.get(cacheKey)
+    if cached is not None and "body" not in cached and bodyArchive is None:
+        # Nothing to answer a 304 with
+        cached = None
+    headers = {}
+    if cached is not None:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    r = _get(urlPostfix, params, headers)
+    if r.status_code == requests.codes.not_modified:
+        with _countLock:
+            countNotModified += 1
+    if r.status_code == requests.codes.not_modified and cached is not None:
+        body = _cachedBody(cached)
+        if body is None:
+            logging.warning("Archived body missing, refetching: {0}".format(
+                urlPostfix))
+            with _validatorsLock:
+                _validators.pop(cacheKey, None)
+            return _request(urlPostfix, params)
+        logging.info("Not modified, using cached body for: {0}".format(
+            urlPostfix))
+        return body
+    elif r.status_code == requests.codes.ok:
+        etag = r.headers.get("ETag")
+        lastModified = r.headers.get("Last-Modified")
+        if etag or lastModified:
+            validator = {"etag": etag, "last_modified": lastModified}
+            if _cachesBody(cacheKey):
+                validator["body"] = r.text
+            else:
+                # Same digest archive.Archive.put files the body under
+                validator["hash"] = hashlib.sha1(
+                    r.text.encode("utf-8")).hexdigest()
+            with _validatorsLock:
+                _validators[cacheKey] = validator
         return r.text
     else:
-        raise Exception("Could not process request. \
-            Received status code {0}.".format(r.status_code))
+        raise RequestError(r.status_code)
+
+
+def _requestStream(urlPostfix, params={}):
+    """Private method returning the raw, decompressed response stream."""
+    requests = _requests()
+    r = _get(urlPostfix, params, stream=True)
+    if r.status_code == requests.codes.ok:
+        r.raw.decode_content = True
+        return r.raw
+    else:
+        r.close()
+        raise RequestError(r.status_code)
+
+
+def requestBatch(func, argsList, workers=None):
+    """Run func over argsList on a pool of threads.
+
+    Yields (args, result, error) tuples in the order they complete, where
+    error is the exception raised by func or None.
+    """
+    if workers is None:
+        workers = maxInFlight
+    pending = queue.Queue()
+    finished = queue.Queue()
+    argsList = list(argsList)
+    for args in argsList:
+        pending.put(args)
+
+    def work():
+        while True:
+            try:
+                args = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                finished.put((args, func(*args), None))
+            except Exception as e:
+                finished.put((args, None, e))
+
+    threads = [threading.Thread(target=work)
+               for _ in range(min(workers, len(argsList)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for _ in argsList:
+        yield finished.get()
+
+
+class _XPath(object):
+
+    """XPath expression compiled on its first use.
+
+    Keeps lxml out of processes that only parse price / volume JSON.
+    """
+
+    def __init__(self, path):
+        """Store the expression."""
+        self.path = path
+        self.compiled = None
+
+    def __call__(self, node):
+        """Evaluate the expression against node."""
+        if self.compiled is None:
+            import lxml.etree
+            self.compiled = lxml.etree.XPath(self.path)
+        return self.compiled(node)
+
+
+def _fromString(html):
+    """Private method parsing an HTML document with lxml."""
+    import lxml.html
+    return lxml.html.fromstring(html)
+
+
+# Precompiled XPath equivalents of the CSS selectors used by the parsers
+_xpathMarketRows = _XPath(
+    "descendant-or-self::*[@id = 'tableMarkets']/tbody/tr")
+_xpathColumns = _XPath(
+    "descendant-or-self::*[@class and contains("
+    "concat(' ', normalize-space(@class), ' '), ' col-md-6 ')]")
+_xpathTableRows = _XPath("descendant::table/tbody/tr")
+_xpathCells = _XPath("descendant::td")
+_xpathLinks = _XPath("descendant::a")
+_xpathSpans = _XPath("descendant::span")
 
 
 def requestExchanges():
@@ -43,20 +480,21 @@ def requestExchanges():
     return _request("v2/markets/info")
 
 
+@metrics.timed("parse", rows=len, parser="exchanges")
 def parseExchanges(html):
     """Parse list of exchanges."""
     data = []
-    exchangesRaw = lxml.html.fromstring(html).cssselect(
-        "#tableMarkets > tbody > tr")
+    exchangesRaw = _xpathMarketRows(_fromString(html))
     for exchangeRaw in exchangesRaw:
         datum = {}
-        columns = exchangeRaw.cssselect("td")
+        columns = _xpathCells(exchangeRaw)
         for columnNum, column in enumerate(columns):
             if columnNum == 0:
-                link = column.cssselect("a")[0]
+                link = _xpathLinks(column)[0]
+                href = link.attrib["href"]
                 datum['name'] = link.text
-                datum['url'] = link.attrib["href"]
-                datum["short_name"] = link.attrib["href"].split("/")[-1]
+                datum['url'] = href
+                datum["short_name"] = href.split("/")[-1]
             elif columnNum == 1:
                 datum['last_update'] = column.attrib["data-sort-value"]
             elif columnNum == 2:
@@ -72,20 +510,21 @@ def requestExchange(shortName):
     return _request("v2/markets/show/{0}".format(shortName))
 
 
+@metrics.timed("parse", rows=lambda result: len(result[1]),
+               parser="exchange")
 def parseExchange(html):
     """Parse information for a single exchange."""
-    data = []
-    doc = lxml.html.fromstring(html).cssselect(".col-md-6")
+    doc = _xpathColumns(_fromString(html))
 
     # Summary data
-    summaryRows = doc[0].cssselect("table > tbody > tr")
+    summaryRows = _xpathTableRows(doc[0])
     summary = {}
     for rowNum, summaryRow in enumerate(summaryRows):
         if rowNum == 0:
             summary["num_trading_pairs"] = int(
-                summaryRow.cssselect("span")[0].text)
+                _xpathSpans(summaryRow)[0].text)
         elif rowNum == 1:
-            volsRaw = summaryRow.cssselect("td")[1].text_content()
+            volsRaw = _xpathCells(summaryRow)[1].text_content()
             volsRaw = volsRaw.strip().split("\n\t\t\t\t\t\t")
             for volCount, volRaw in enumerate(volsRaw):
                 volParts = volRaw.strip().split(u"\xa0")
@@ -94,35 +533,37 @@ def parseExchange(html):
                 summary["vol_{0}_unit".format(volCount+1)] = volParts[1].lower(
                     )
         elif rowNum == 2:
-            candidateDatetime = summaryRow.cssselect(
-                "td")[1].text.split("<br />")[0].strip()
+            candidateDatetime = _xpathCells(
+                summaryRow)[1].text.split("<br />")[0].strip()
             if candidateDatetime == '':
                 summary["last_updated"] = None
             else:
                 summary["last_updated"] = datetime.strptime(
                     candidateDatetime, "%Y-%m-%d %H:%M:%S")
         elif rowNum == 3:
-            summary["url"] = summaryRow.cssselect("a")[0].attrib["href"]
+            summary["url"] = _xpathLinks(summaryRow)[0].attrib["href"]
 
     # Pair Data
-    pairRows = doc[1].cssselect("table > tbody > tr")
+    pairRows = _xpathTableRows(doc[1])
     pairs = []
     for pairRow in pairRows:
-        columns = pairRow.cssselect("td")
+        columns = _xpathCells(pairRow)
         pair = {}
         for columnNum, column in enumerate(columns):
             if columnNum == 0:
-                link = column.cssselect("a")[0]
+                link = _xpathLinks(column)[0]
+                href = link.attrib["href"]
+                hrefParts = href.split("/")
                 pair['name'] = link.text
-                pair['url'] = link.attrib["href"]
-                pair['source'] = link.attrib["href"].split("/")[-2]
-                pair['sink'] = link.attrib["href"].split("/")[-3]
+                pair['url'] = href
+                pair['source'] = hrefParts[-2]
+                pair['sink'] = hrefParts[-3]
             elif columnNum == 1:
                 pair['source_price'] = float(
                     column.text.split(' ')[0].replace(',', ''))
             else:
                 raw = column.text.split(' ')[0].split(u"\xa0")
-                rawVolume = raw[0]
+                volume = float(raw[0].replace(',', ''))
                 currency = raw[1].lower()
 
                 if currency == pair['source']:
@@ -132,28 +573,48 @@ def parseExchange(html):
                 else:
                     currencyType = currency
 
-                pair["{0}_volume".format(currencyType)] = float(
-                    rawVolume.replace(',', ''))
+                pair["{0}_volume".format(currencyType)] = volume
 
                 if currency == 'btc':
-                    pair['btc_volume'] = float(rawVolume.replace(',', ''))
+                    pair['btc_volume'] = volume
 
         pairs.append(pair)
 
     return summary, pairs
 
 
-def requestPriceVolume(source, sink, exchange, time, resolution):
-    """Request price / volume data for specific exchange & trading pair."""
-    payload = {
+def _priceVolumePayload(source, sink, exchange, time, resolution):
+    """Private method building the period.php query parameters."""
+    return {
         "pair": "{0}-{1}".format(sink, source),
         "market": exchange,
         "time": time,
         "resolution": resolution
     }
-    return _request("v2/fast/period.php", payload)
 
 
+def requestPriceVolume(source, sink, exchange, time, resolution):
+    """Request price / volume data for specific exchange & trading pair."""
+    return _request("v2/fast/period.php", _priceVolumePayload(
+        source, sink, exchange, time, resolution))
+
+
+def requestPriceVolumeStream(source, sink, exchange, time, resolution):
+    """Request price / volume data as a file-like stream."""
+    return _requestStream("v2/fast/period.php", _priceVolumePayload(
+        source, sink, exchange, time, resolution))
+
+
+def requestPriceVolumeBatch(paramsList, workers=None):
+    """Request price / volume data for many pairs concurrently.
+
+    Each entry of paramsList holds the requestPriceVolume arguments. Yields
+    (params, jsonDump, error) tuples as the requests finish.
+    """
+    return requestBatch(requestPriceVolume, paramsList, workers)
+
+
+@metrics.timed("parse", rows=len, parser="price_volume")
 def parsePriceVolume(jsonDump, source, sink, exchange):
     """Parse price / volume data for specific exchange & trading pair."""
     rows = json.loads(jsonDump)
@@ -164,7 +625,7 @@ def parsePriceVolume(jsonDump, source, sink, exchange):
         datum["sink"] = sink
         datum["exchange"] = exchange
         if len(row[0]) == 10:
-            datum["date"] = date.strptime(row[0], "%Y-%m-%d")
+            datum["date"] = datetime.strptime(row[0], "%Y-%m-%d").date()
         elif len(row[0]) == 13:
             datum["hour"] = datetime.strptime(row[0], "%Y-%m-%d %H")
         datum["price_low"] = row[1]
@@ -180,6 +641,102 @@ def parsePriceVolume(jsonDump, source, sink, exchange):
     return data
 
 
+class PriceVolumeRow(object):
+
+    """Compact price / volume record produced by iterPriceVolume."""
+
+    __slots__ = [
+        "source", "sink", "exchange", "hour", "date",
+        "price_low", "price_25th_percentile", "price_75th_percentile",
+        "price_high", "price_median", "price_ema20", "volume",
+        "field_7", "field_8"]
+
+    def __init__(self, row, source, sink, exchange):
+        """Build a record from a raw period.php row."""
+        self.source = source
+        self.sink = sink
+        self.exchange = exchange
+        self.hour = None
+        self.date = None
+        if len(row[0]) == 10:
+            self.date = datetime.strptime(row[0], "%Y-%m-%d").date()
+        elif len(row[0]) == 13:
+            self.hour = datetime.strptime(row[0], "%Y-%m-%d %H")
+        self.price_low = row[1]
+        self.price_25th_percentile = row[2]
+        self.price_75th_percentile = row[3]
+        self.price_high = row[4]
+        self.price_median = row[5]
+        self.price_ema20 = row[9]
+        self.volume = row[6]
+        self.field_7 = row[7]
+        self.field_8 = row[8]
+
+    def __getitem__(self, key):
+        """Allow dictionary-style access, as used by the pg loaders."""
+        return getattr(self, key)
+
+    def asDict(self):
+        """Return the record in the parsePriceVolume dictionary format."""
+        datum = dict((key, getattr(self, key)) for key in self.__slots__)
+        if datum["date"] is None:
+            del datum["date"]
+        if datum["hour"] is None:
+            del datum["hour"]
+        return datum
+
+
+_jsonSeparators = re.compile(r"[\s,]*")
+
+
+def _iterJsonArray(stream, chunkSize):
+    """Private generator over the elements of a streamed JSON array."""
+    decoder = json.JSONDecoder()
+    textDecoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    started = False
+    eof = False
+    while True:
+        pos = _jsonSeparators.match(buf, pos).end()
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("Expected a JSON array.")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # Element is split across chunks unless the input is done
+                if eof:
+                    raise
+            else:
+                yield value
+                pos = end
+                continue
+        elif eof:
+            raise ValueError("Unterminated JSON array.")
+        chunk = stream.read(chunkSize)
+        eof = not chunk
+        if isinstance(chunk, bytes) and bytes is not str:
+            chunk = textDecoder.decode(chunk, eof)
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+def iterPriceVolume(stream, source, sink, exchange, chunkSize=65536):
+    """Incrementally parse price / volume data from a file-like stream.
+
+    Yields PriceVolumeRow records without holding the whole dump in memory.
+    """
+    for row in _iterJsonArray(stream, chunkSize):
+        yield PriceVolumeRow(row, source, sink, exchange)
+
+
 class CryptocoinchartsTest(unittest.TestCase):
 
     """Class for testing cryptocoincharts module."""
@@ -191,7 +748,7 @@ class CryptocoinchartsTest(unittest.TestCase):
             os.path.abspath(__file__))), 'w')
         f.write(html)
         f.close()
-        receivedTitle = lxml.html.fromstring(html).cssselect("title")[0].text
+        receivedTitle = _fromString(html).cssselect("title")[0].text
         self.assertEqual(receivedTitle, "List of all cryptocurrency exchanges")
 
     def testParseExchanges(self):
@@ -215,7 +772,7 @@ class CryptocoinchartsTest(unittest.TestCase):
             os.path.abspath(__file__))), 'w')
         f.write(html)
         f.close()
-        receivedTitle = lxml.html.fromstring(html).cssselect("title")[0].text
+        receivedTitle = _fromString(html).cssselect("title")[0].text
         expTitle = "BTC-e trading pairs and other informations and statistics"
         self.assertEqual(receivedTitle, expTitle)
 
@@ -270,5 +827,158 @@ class CryptocoinchartsTest(unittest.TestCase):
         f.close()
         data = parsePriceVolume(jsonDump, "usd", "btc", "btc-e")
 
+    def testParsePriceVolumeDaily(self):
+        """Test parsePriceVolume with daily resolution."""
+        data = parsePriceVolume(
+            '[["2014-07-21",610,612,616,620,614,3000.5,1842307.2,0,613.9]]',
+            "usd", "btc", "btc-e")
+        self.assertEqual(data[0]["date"], date(2014, 7, 21))
+        self.assertFalse("hour" in data[0])
+        self.assertEqual(data[0]["price_ema20"], 613.9)
+
+    def testIterPriceVolume(self):
+        """Test iterPriceVolume matches parsePriceVolume."""
+        fileString = "{0}/example/price_volume_usd_btc_btc-e_alltime_1h.json"
+        f = open(fileString.format(
+            os.path.dirname(os.path.abspath(__file__))), 'rb')
+        jsonDump = f.read()
+        f.seek(0)
+        rows = [row.asDict() for row in iterPriceVolume(
+            f, "usd", "btc", "btc-e", chunkSize=1000)]
+        f.close()
+        self.assertEqual(rows, parsePriceVolume(
+            jsonDump, "usd", "btc", "btc-e"))
+
+    def testTokenBucket(self):
+        """Test TokenBucket class."""
+        bucket = TokenBucket(50, 2)
+        self.assertEqual(bucket.consume(), 0)
+        self.assertEqual(bucket.consume(), 0)
+        slept = bucket.consume()
+        self.assertTrue(0 < slept <= 0.05)
+
+    def testAdaptiveRate(self):
+        """Test AdaptiveRate class."""
+        controller = AdaptiveRate(TokenBucket(1, 1))
+        sentAt = time.time()
+        self.assertAlmostEqual(controller.record(True, sentAt),
+                               1 + rateIncrease)
+        self.assertAlmostEqual(controller.record(False, sentAt),
+                               (1 + rateIncrease) * rateDecrease)
+        # A request sent before the cut does not cut the rate again
+        self.assertAlmostEqual(controller.record(False, sentAt),
+                               (1 + rateIncrease) * rateDecrease)
+        self.assertAlmostEqual(controller.record(False, time.time()),
+                               (1 + rateIncrease) * rateDecrease ** 2)
+
+    def testRetry(self):
+        """Test _request retries transient errors against a stub server."""
+        import bench
+        global baseUrl, backoffBase, interReqTime
+        server = bench.stubServer(
+            {"/v2/markets/info": u"[]"},
+            faults=[(503, {"Retry-After": "0"}), (429, {}), (500, {})])
+        settings = (baseUrl, backoffBase, interReqTime)
+        baseUrl = "http://127.0.0.1:{0}".format(server.server_port)
+        backoffBase = 0.01
+        interReqTime = 0.01
+        try:
+            requestedBefore = countRequested
+            self.assertEqual(_request("v2/markets/info"), "[]")
+            self.assertEqual(countRequested, requestedBefore + 4)
+            self.assertRaises(RequestError, _request, "v2/markets/other")
+        finally:
+            baseUrl, backoffBase, interReqTime = settings
+            server.shutdown()
+            server.server_close()
+
+    def testRequestBatch(self):
+        """Test requestBatch function."""
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def fetch(source, sink):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.pop()
+            if sink == "bad":
+                raise ValueError(sink)
+            return "{0}-{1}".format(sink, source)
+
+        argsList = [("usd", "btc"), ("usd", "ltc"), ("eur", "bad")]
+        results = dict(
+            (args, (result, error)) for args, result, error in requestBatch(
+                fetch, argsList, workers=3))
+        self.assertEqual(results[("usd", "btc")], ("btc-usd", None))
+        self.assertEqual(results[("usd", "ltc")], ("ltc-usd", None))
+        self.assertTrue(isinstance(results[("eur", "bad")][1], ValueError))
+        self.assertTrue(max(peak) > 1)
+
+    def testConditionalRequest(self):
+        """Test _request revalidation against a local server."""
+        import archive
+        try:
+            from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        except ImportError:
+            from http.server import BaseHTTPRequestHandler, HTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.headers.get("If-None-Match") == '"v1"':
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                body = b"[]"
+                self.send_response(200)
+                self.send_header("ETag", '"v1"')
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        global baseUrl, bodyArchive
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        baseUrlOriginal = baseUrl
+        baseUrl = "http://127.0.0.1:{0}".format(server.server_port)
+        try:
+            notModifiedBefore = countNotModified
+            self.assertEqual(_request("v2/markets/info"), "[]")
+            self.assertEqual(_request("v2/markets/info"), "[]")
+            self.assertEqual(countNotModified, notModifiedBefore + 1)
+
+            # Price / volume validators keep a hash, not the body
+            archivePath = tempfile.mkdtemp()
+            bodyArchive = archive.Archive(archivePath)
+            try:
+                params = {"pair": "usd_btc"}
+                self.assertEqual(_request("v2/fast/period.php", params), "[]")
+                validator = [
+                    validator for url, validator in _validators.items()
+                    if "period.php" in url][0]
+                self.assertFalse("body" in validator)
+                # Not archived yet, so the 304 is followed by a refetch
+                self.assertEqual(_request("v2/fast/period.php", params), "[]")
+                self.assertEqual(countNotModified, notModifiedBefore + 2)
+                bodyArchive.put(u"[]", "price_volume_usd_btc", "json")
+                self.assertEqual(_request("v2/fast/period.php", params), "[]")
+                self.assertEqual(countNotModified, notModifiedBefore + 3)
+            finally:
+                bodyArchive.close()
+                bodyArchive = None
+                shutil.rmtree(archivePath)
+        finally:
+            baseUrl = baseUrlOriginal
+            server.shutdown()
+            server.server_close()
+
 if __name__ == "__main__":
     unittest.main()
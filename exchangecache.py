@@ -0,0 +1,87 @@
+"""Cache of exchange pair lists keyed by the exchange list's last_update."""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class ExchangeCache(object):
+
+    """Pair lists of exchanges whose price / volume data is fully loaded.
+
+    An exchange is only cached once every one of its pairs was loaded, so
+    an exchange whose last_update has not moved since needs no requests.
+    """
+
+    def __init__(self, path):
+        """Read the cache file at path if it exists."""
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            f = open(path, 'r')
+            self.entries = json.load(f)
+            f.close()
+
+    def isUnchanged(self, exchange):
+        """Return whether an exchange is unchanged since it was cached."""
+        entry = self.entries.get(exchange["short_name"])
+        return bool(entry is not None and exchange.get("last_update") and
+                    entry["last_update"] == exchange["last_update"])
+
+    def pairs(self, exchange):
+        """Return the cached pairs of an unchanged exchange, or None."""
+        if not self.isUnchanged(exchange):
+            return None
+        return self.entries[exchange["short_name"]]["pairs"]
+
+    def update(self, exchange, pairs):
+        """Cache the pairs of an exchange at its current last_update."""
+        self.entries[exchange["short_name"]] = {
+            "last_update": exchange.get("last_update"),
+            "num_trading_pairs": exchange.get("num_trading_pairs"),
+            "pairs": pairs
+        }
+
+    def save(self):
+        """Write the cache, replacing the file atomically."""
+        temporaryPath = "{0}.tmp".format(self.path)
+        f = open(temporaryPath, 'w')
+        json.dump(self.entries, f)
+        f.close()
+        os.rename(temporaryPath, self.path)
+
+
+class ExchangeCacheTest(unittest.TestCase):
+
+    """Testing suite for exchangecache module."""
+
+    def setUp(self):
+        """Create a scratch directory."""
+        self.path = tempfile.mkdtemp()
+        self.cacheFile = os.path.join(self.path, "exchange_cache.json")
+
+    def tearDown(self):
+        """Remove the scratch directory."""
+        shutil.rmtree(self.path)
+
+    def testUnchanged(self):
+        """Test exchanges are skipped until last_update moves."""
+        exchange = {"short_name": "btc-e", "last_update": "1405976542"}
+        pairs = [{"source": "usd", "sink": "btc"}]
+        exchangeCache = ExchangeCache(self.cacheFile)
+        self.assertFalse(exchangeCache.isUnchanged(exchange))
+        exchangeCache.update(exchange, pairs)
+        exchangeCache.save()
+
+        exchangeCache = ExchangeCache(self.cacheFile)
+        self.assertTrue(exchangeCache.isUnchanged(exchange))
+        self.assertEqual(exchangeCache.pairs(exchange), pairs)
+        moved = {"short_name": "btc-e", "last_update": "1405976600"}
+        self.assertFalse(exchangeCache.isUnchanged(moved))
+        self.assertEqual(exchangeCache.pairs(moved), None)
+        self.assertFalse(exchangeCache.isUnchanged(
+            {"short_name": "btc-e", "last_update": ""}))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+"""Columnar, NumPy-backed container for price / volume data."""
+import cryptocoincharts
+import io
+import json
+import metrics
+import numpy as np
+import os
+import unittest
+
+# Value columns and their position in a raw period.php row
+fields = [
+    ("price_low", 1),
+    ("price_25th_percentile", 2),
+    ("price_75th_percentile", 3),
+    ("price_high", 4),
+    ("price_median", 5),
+    ("price_ema20", 9),
+    ("volume", 6),
+    ("field_7", 7),
+    ("field_8", 8)
+]
+
+
+class PriceVolumeFrame(object):
+
+    """Price / volume data for one pair with one contiguous array per field.
+
+    Missing values are stored as NaN. The time column has dtype
+    datetime64[h] for hourly data, or datetime64[D] for daily data, and is
+    held in the hour attribute either way.
+    """
+
+    def __init__(self, source, sink, exchange, hour, columns):
+        """Wrap an hour array and a dictionary of float64 arrays."""
+        self.source = source
+        self.sink = sink
+        self.exchange = exchange
+        self.hour = hour
+        self.columns = columns
+
+    @classmethod
+    def fromRows(cls, rows, source, sink, exchange):
+        """Build a frame from decoded period.php rows."""
+        keys = np.array([row[0] for row in rows], dtype="U13")
+        if len(keys) and len(keys[0]) == 10:
+            hour = keys.astype("datetime64[D]")
+        else:
+            hour = np.char.replace(keys, " ", "T").astype("datetime64[h]")
+        values = np.array(
+            [row[1:10] for row in rows], dtype=np.float64).reshape(-1, 9)
+        columns = dict(
+            (name, np.ascontiguousarray(values[:, index - 1]))
+            for name, index in fields)
+        return cls(source, sink, exchange, hour, columns)
+
+    @classmethod
+    @metrics.timed("parse", rows=len, parser="price_volume_frame")
+    def fromJson(cls, jsonDump, source, sink, exchange):
+        """Parse a period.php JSON dump into a frame."""
+        return cls.fromRows(json.loads(jsonDump), source, sink, exchange)
+
+    @property
+    def timeColumn(self):
+        """Return "date" for daily frames and "hour" for hourly ones."""
+        if self.hour.dtype == np.dtype("datetime64[D]"):
+            return "date"
+        return "hour"
+
+    def __len__(self):
+        """Return the number of rows."""
+        return len(self.hour)
+
+    def __getitem__(self, name):
+        """Return the array for a column."""
+        if name == self.timeColumn:
+            return self.hour
+        return self.columns[name]
+
+    def __getattr__(self, name):
+        """Expose the value columns as attributes."""
+        try:
+            return self.__dict__["columns"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def asDicts(self):
+        """Return the rows in the parsePriceVolume dictionary format."""
+        hours = self.hour.astype(object)
+        columns = [(name, self.columns[name].tolist()) for name, _ in fields]
+        data = []
+        for rowNum, hour in enumerate(hours):
+            datum = {
+                "source": self.source,
+                "sink": self.sink,
+                "exchange": self.exchange,
+                self.timeColumn: hour
+            }
+            for name, values in columns:
+                value = values[rowNum]
+                datum[name] = None if value != value else value
+            data.append(datum)
+        return data
+
+    def copyReader(self, columns):
+        """Return a file-like object with the rows in COPY text format."""
+        constants = {
+            "source": self.source,
+            "sink": self.sink,
+            "exchange": self.exchange
+        }
+        timeUnit = "D" if self.timeColumn == "date" else "s"
+        formatted = []
+        for name in columns:
+            if name in constants:
+                formatted.append([constants[name]] * len(self))
+            elif name == self.timeColumn:
+                formatted.append(
+                    np.datetime_as_string(self.hour, unit=timeUnit))
+            else:
+                values = self.columns[name]
+                formatted.append(np.where(
+                    np.isnan(values), "\\N", values.astype(str)))
+        return io.StringIO(u"".join(
+            u"\t".join(row) + u"\n" for row in zip(*formatted)))
+
+
+class FrameTest(unittest.TestCase):
+
+    """Testing suite for frame module."""
+
+    def setUp(self):
+        """Read the example price / volume dump."""
+        fileString = "{0}/example/price_volume_usd_btc_btc-e_alltime_1h.json"
+        f = open(fileString.format(
+            os.path.dirname(os.path.abspath(__file__))), 'r')
+        self.jsonDump = f.read()
+        f.close()
+
+    def testFromJson(self):
+        """Test fromJson matches parsePriceVolume."""
+        frame = PriceVolumeFrame.fromJson(
+            self.jsonDump, "usd", "btc", "btc-e")
+        self.assertEqual(frame.hour.dtype, np.dtype("datetime64[h]"))
+        self.assertEqual(frame.asDicts(), cryptocoincharts.parsePriceVolume(
+            self.jsonDump, "usd", "btc", "btc-e"))
+
+    def testCopyReader(self):
+        """Test copyReader output."""
+        frame = PriceVolumeFrame.fromJson(
+            self.jsonDump, "usd", "btc", "btc-e")
+        lines = frame.copyReader(["exchange", "hour", "price_ema20"]).read(
+            ).splitlines()
+        self.assertEqual(len(lines), len(frame))
+        self.assertEqual(lines[0], u"btc-e\t2013-06-26T22:00:00\t\\N")
+
+    def testDaily(self):
+        """Test daily frames use a date column."""
+        jsonDump = \
+            '[["2014-07-21",610,612,616,620,614,3000.5,1842307.2,0,null]]'
+        frame = PriceVolumeFrame.fromJson(jsonDump, "usd", "btc", "btc-e")
+        self.assertEqual(frame.timeColumn, "date")
+        self.assertEqual(frame.asDicts(), cryptocoincharts.parsePriceVolume(
+            jsonDump, "usd", "btc", "btc-e"))
+        self.assertEqual(
+            frame.copyReader(["date", "volume"]).read(),
+            u"2014-07-21\t3000.5\n")
+
+if __name__ == "__main__":
+    unittest.main()
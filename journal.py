@@ -0,0 +1,168 @@
+"""Crash-safe run journal so interrupted scrapes resume where they stopped."""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+class Journal(object):
+
+    """Append-only journal of the work completed by the current run.
+
+    Every entry is one JSON line written and fsynced before the work it
+    records is treated as done, so after a crash the journal holds exactly
+    the completed work. Completion is recorded per pair rather than per
+    worker, so a run can be resumed with different worker counts.
+    """
+
+    def __init__(self, path):
+        """Open the journal at path, reading any unfinished run."""
+        self.path = path
+        self.lock = threading.Lock()
+        self.runStarted = None
+        self.exchangeList = None
+        self.exchangePairs = {}
+        self.loaded = set()
+        self.finished = True
+        self.validLength = 0
+        if os.path.exists(path):
+            self._read()
+        self.file = None
+
+    def _read(self):
+        """Private method replaying the entries of the journal file."""
+        f = open(self.path, 'rb')
+        for line in f:
+            if not line.endswith(b"\n"):
+                # A crash can leave a partially written last line
+                break
+            try:
+                entry = json.loads(line.decode("utf-8"))
+            except ValueError:
+                break
+            self._apply(entry)
+            self.validLength += len(line)
+        f.close()
+
+    def _apply(self, entry):
+        """Private method applying one entry to the in-memory state."""
+        if entry["type"] == "start":
+            self.runStarted = entry["time"]
+            self.finished = False
+        elif entry["type"] == "exchanges":
+            self.exchangeList = entry["exchanges"]
+        elif entry["type"] == "exchange":
+            self.exchangePairs[entry["short_name"]] = entry["pairs"]
+        elif entry["type"] == "loaded":
+            self.loaded.add((entry["exchange"], entry["source"],
+                             entry["sink"], entry.get("resolution", "1h")))
+        elif entry["type"] == "finish":
+            self.finished = True
+
+    def _write(self, entry):
+        """Private method durably appending an entry."""
+        with self.lock:
+            self._apply(entry)
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def begin(self):
+        """Resume the unfinished run or start a new one.
+
+        Returns True when an unfinished run is resumed.
+        """
+        if not self.finished:
+            self.file = open(self.path, 'a')
+            self.file.truncate(self.validLength)
+            return True
+        self.exchangeList = None
+        self.exchangePairs = {}
+        self.loaded = set()
+        self.file = open(self.path, 'w')
+        self._write({"type": "start", "time": int(time.time())})
+        return False
+
+    def exchanges(self):
+        """Return the journaled exchange list, or None."""
+        return self.exchangeList
+
+    def recordExchanges(self, exchanges):
+        """Record the parsed exchange list."""
+        self._write({"type": "exchanges", "exchanges": exchanges})
+
+    def pairs(self, shortName):
+        """Return the journaled pairs of an exchange, or None."""
+        return self.exchangePairs.get(shortName)
+
+    def recordPairs(self, shortName, pairs):
+        """Record the parsed pairs of an exchange."""
+        self._write(
+            {"type": "exchange", "short_name": shortName, "pairs": pairs})
+
+    def isLoaded(self, exchange, source, sink, resolution="1h"):
+        """Return whether a pair was already loaded by this run."""
+        return (exchange, source, sink, resolution) in self.loaded
+
+    def recordLoaded(self, exchange, source, sink, resolution="1h"):
+        """Record that a pair's price / volume data was committed."""
+        self._write({"type": "loaded", "exchange": exchange,
+                     "source": source, "sink": sink,
+                     "resolution": resolution})
+
+    def finish(self):
+        """Mark the run as complete so the next run starts afresh."""
+        self._write({"type": "finish", "time": int(time.time())})
+        self.file.close()
+        self.file = None
+
+
+class JournalTest(unittest.TestCase):
+
+    """Testing suite for journal module."""
+
+    def setUp(self):
+        """Create a scratch directory."""
+        self.path = tempfile.mkdtemp()
+        self.journalFile = os.path.join(self.path, "journal.jsonl")
+
+    def tearDown(self):
+        """Remove the scratch directory."""
+        shutil.rmtree(self.path)
+
+    def testResume(self):
+        """Test an interrupted run is resumed."""
+        runJournal = Journal(self.journalFile)
+        self.assertFalse(runJournal.begin())
+        runJournal.recordExchanges([{"short_name": "btc-e"}])
+        runJournal.recordPairs("btc-e", [{"source": "usd", "sink": "btc"}])
+        runJournal.recordLoaded("btc-e", "usd", "btc")
+        runJournal.file.close()
+
+        # Simulate a crash in the middle of writing an entry
+        f = open(self.journalFile, 'a')
+        f.write('{"type": "loaded", "exch')
+        f.close()
+
+        resumed = Journal(self.journalFile)
+        self.assertTrue(resumed.begin())
+        self.assertEqual(resumed.exchanges(), [{"short_name": "btc-e"}])
+        self.assertEqual(resumed.pairs("btc-e"),
+                         [{"source": "usd", "sink": "btc"}])
+        self.assertEqual(resumed.pairs("bitstamp"), None)
+        self.assertTrue(resumed.isLoaded("btc-e", "usd", "btc"))
+        self.assertFalse(resumed.isLoaded("btc-e", "usd", "ltc"))
+        self.assertFalse(resumed.isLoaded("btc-e", "usd", "btc", "1d"))
+        resumed.finish()
+
+        fresh = Journal(self.journalFile)
+        self.assertFalse(fresh.begin())
+        self.assertEqual(fresh.exchanges(), None)
+        self.assertFalse(fresh.isLoaded("btc-e", "usd", "btc"))
+        fresh.finish()
+
+if __name__ == "__main__":
+    unittest.main()
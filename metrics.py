@@ -0,0 +1,274 @@
+"""Lightweight counters, histograms and timers for every scrape stage.
+
+Metrics live in one process-wide registry and are exported at the end of a
+run as a Prometheus textfile or a JSON summary. Recording a value costs a
+lock and a dictionary lookup, so instrumentation can stay on in
+production.
+"""
+import functools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+# Configuration variables
+enabled = True
+namespace = "cryptocoincharts"
+defaultBuckets = [
+    0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# Registry state, keyed by (name, sorted label items)
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+class Histogram(object):
+
+    """Bucketed distribution of observed values."""
+
+    def __init__(self, buckets=None):
+        """Create an empty histogram with upper bucket bounds."""
+        self.buckets = buckets or defaultBuckets
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        """Record one value."""
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for bucketNum, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[bucketNum] += 1
+                break
+
+    def summary(self):
+        """Return count, sum, mean, min and max."""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max
+        }
+
+
+def _key(name, labels):
+    """Private method building the registry key for a metric.
+
+    Label values are kept as strings, as Prometheus does, so a label
+    recorded both as a status code and as a word still sorts.
+    """
+    return (name, tuple(sorted(
+        (key, str(value)) for key, value in labels.items())))
+
+
+def count(name, value=1, **labels):
+    """Add value to a counter."""
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record a value in a histogram."""
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        if key not in _histograms:
+            _histograms[key] = Histogram()
+        _histograms[key].observe(value)
+
+
+class timer(object):
+
+    """Context manager recording its duration in a histogram."""
+
+    def __init__(self, name, **labels):
+        """Name the histogram the duration goes to."""
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        """Start timing."""
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *excInfo):
+        """Stop timing and record the duration."""
+        observe(self.name, time.time() - self.start, **self.labels)
+
+
+def timed(name, rows=None, **labels):
+    """Decorator timing every call in the histogram <name>_seconds.
+
+    If rows is given it is called with the result and its value is added
+    to the counter <name>_rows.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            result = func(*args, **kwargs)
+            observe("{0}_seconds".format(name), time.time() - start,
+                    **labels)
+            if rows is not None:
+                count("{0}_rows".format(name), rows(result), **labels)
+            return result
+        return wrapper
+    return decorator
+
+
+def reset():
+    """Clear every metric."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _labelText(labels, extra=()):
+    """Private method formatting labels in Prometheus syntax."""
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(
+        '{0}="{1}"'.format(key, str(value).replace('"', '\\"'))
+        for key, value in items) + "}"
+
+
+def prometheusText():
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            lines.append("{0}_{1}_total{2} {3}".format(
+                namespace, name, _labelText(labels), value))
+        for (name, labels), histogram in sorted(_histograms.items()):
+            metric = "{0}_{1}".format(namespace, name)
+            cumulative = 0
+            for bound, bucketCount in zip(
+                    histogram.buckets, histogram.counts):
+                cumulative += bucketCount
+                lines.append("{0}_bucket{1} {2}".format(
+                    metric, _labelText(labels, [("le", bound)]), cumulative))
+            lines.append("{0}_bucket{1} {2}".format(
+                metric, _labelText(labels, [("le", "+Inf")]),
+                histogram.count))
+            lines.append("{0}_sum{1} {2}".format(
+                metric, _labelText(labels), histogram.sum))
+            lines.append("{0}_count{1} {2}".format(
+                metric, _labelText(labels), histogram.count))
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    """Return every metric as a JSON-serializable dictionary."""
+    with _lock:
+        return {
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(_counters.items())],
+            "histograms": [
+                dict(histogram.summary(), name=name, labels=dict(labels))
+                for (name, labels), histogram in sorted(_histograms.items())]
+        }
+
+
+def _writeAtomically(path, content):
+    """Private method replacing a file so readers never see partial data."""
+    temporaryPath = "{0}.tmp".format(path)
+    f = open(temporaryPath, 'w')
+    f.write(content)
+    f.close()
+    os.rename(temporaryPath, path)
+
+
+def writePrometheus(path):
+    """Write a Prometheus textfile collector file."""
+    _writeAtomically(path, prometheusText())
+
+
+def writeJson(path):
+    """Write the JSON summary."""
+    _writeAtomically(path, json.dumps(summary(), indent=2, sort_keys=True))
+
+
+class MetricsTest(unittest.TestCase):
+
+    """Testing suite for metrics module."""
+
+    def setUp(self):
+        """Start from an empty registry."""
+        reset()
+
+    def tearDown(self):
+        """Leave an empty registry behind."""
+        reset()
+
+    def testRecord(self):
+        """Test counters, timers and the timed decorator."""
+        count("request_bytes", 10, path="info")
+        count("request_bytes", 5, path="info")
+        with timer("load_seconds", step="commit"):
+            pass
+
+        @timed("parse", rows=len, parser="test")
+        def parse():
+            return [1, 2, 3]
+
+        parse()
+        result = summary()
+        self.assertEqual(result["counters"], [
+            {"name": "parse_rows", "labels": {"parser": "test"}, "value": 3},
+            {"name": "request_bytes", "labels": {"path": "info"},
+             "value": 15}])
+        self.assertEqual(
+            [(histogram["name"], histogram["count"])
+             for histogram in result["histograms"]],
+            [("load_seconds", 1), ("parse_seconds", 1)])
+
+    def testPrometheusText(self):
+        """Test Prometheus export."""
+        observe("request_seconds", 0.02, status=200)
+        observe("request_seconds", 7, status=200)
+        path = tempfile.mkdtemp()
+        try:
+            writePrometheus(os.path.join(path, "metrics.prom"))
+            f = open(os.path.join(path, "metrics.prom"), 'r')
+            lines = f.read().splitlines()
+            f.close()
+        finally:
+            shutil.rmtree(path)
+        self.assertTrue('cryptocoincharts_request_seconds_bucket'
+                        '{status="200",le="0.05"} 1' in lines)
+        self.assertTrue('cryptocoincharts_request_seconds_bucket'
+                        '{status="200",le="+Inf"} 2' in lines)
+        self.assertTrue('cryptocoincharts_request_seconds_count'
+                        '{status="200"} 2' in lines)
+
+    def testMixedLabelTypes(self):
+        """Test an endpoint with both a response and an error exports."""
+        count("requests", endpoint="v2/markets/info", status=200)
+        count("requests", endpoint="v2/markets/info", status="error")
+        count("requests", endpoint="v2/markets/info", status=200)
+        self.assertEqual(
+            [(counter["labels"]["status"], counter["value"])
+             for counter in summary()["counters"]],
+            [("200", 2), ("error", 1)])
+        self.assertTrue('cryptocoincharts_requests_total{endpoint='
+                        '"v2/markets/info",status="error"} 1'
+                        in prometheusText().splitlines())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,22 @@
+"""Move response files written by writeToFile into the response archive."""
+import archive
+import logging
+import os
+import sys
+
+dataDir = "{0}/data".format(os.path.dirname(os.path.abspath(__file__)))
+archiveDir = "{0}/archive".format(dataDir)
+
+# Set logging level
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s:%(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p')
+
+# Pass --remove to delete each file once it is committed to the archive
+logging.info("Starting migration of {0} into {1}.".format(
+    dataDir, archiveDir))
+responseArchive = archive.Archive(archiveDir)
+count = archive.migrate(dataDir, responseArchive, "--remove" in sys.argv)
+responseArchive.close()
+logging.info("Finished migration of {0} files.".format(count))
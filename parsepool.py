@@ -0,0 +1,149 @@
+"""Process-pool parsing of raw cryptocoincharts responses."""
+import archive
+import cryptocoincharts
+import frame
+import multiprocessing
+import os
+import unittest
+
+
+def _parsePriceVolume(job):
+    """Private worker parsing a price / volume dump into a frame.
+
+    Frames pickle as a handful of flat arrays, which is far cheaper to send
+    back to the parent than one dictionary per row.
+    """
+    jsonDump, source, sink, exchange = job
+    return frame.PriceVolumeFrame.fromJson(jsonDump, source, sink, exchange)
+
+
+def _parsePriceVolumeFile(job):
+    """Private worker reading and parsing a price / volume dump file."""
+    path, source, sink, exchange = job
+    f = open(path, 'r')
+    jsonDump = f.read()
+    f.close()
+    return _parsePriceVolume((jsonDump, source, sink, exchange))
+
+
+# Archives opened by this worker process, keyed by path
+_archives = {}
+
+
+def _parsePriceVolumeArchived(job):
+    """Private worker reading a dump from the response archive and parsing it.
+
+    Each worker process opens the archive once and reuses it.
+    """
+    archivePath, digest, source, sink, exchange = job
+    if archivePath not in _archives:
+        _archives[archivePath] = archive.Archive(archivePath)
+    jsonDump = _archives[archivePath].get(digest)
+    return _parsePriceVolume((jsonDump, source, sink, exchange))
+
+
+def _parseExchange(html):
+    """Private worker parsing a single exchange page."""
+    return cryptocoincharts.parseExchange(html)
+
+
+class ParsePool(object):
+
+    """Pool of worker processes for CPU-bound parsing.
+
+    Price / volume dumps come back as PriceVolumeFrame objects, which the
+    pg loaders accept directly.
+    """
+
+    def __init__(self, processes=None):
+        """Start the worker processes, one per core by default."""
+        self.pool = multiprocessing.Pool(processes)
+
+    def parsePriceVolume(self, jsonDump, source, sink, exchange):
+        """Parse one price / volume dump in a worker and wait for it."""
+        return self.pool.apply(
+            _parsePriceVolume, ((jsonDump, source, sink, exchange),))
+
+    def parseExchange(self, html):
+        """Parse one exchange page in a worker and wait for it."""
+        return self.pool.apply(_parseExchange, (html,))
+
+    def _imap(self, worker, jobs, chunksize, ordered):
+        """Private method mapping a worker over jobs."""
+        if ordered:
+            return self.pool.imap(worker, jobs, chunksize)
+        return self.pool.imap_unordered(worker, jobs, chunksize)
+
+    def imapPriceVolume(self, jobs, chunksize=1, ordered=False):
+        """Parse (jsonDump, source, sink, exchange) jobs.
+
+        Results arrive as they finish unless ordered is set.
+        """
+        return self._imap(_parsePriceVolume, jobs, chunksize, ordered)
+
+    def imapPriceVolumeFiles(self, jobs, chunksize=1, ordered=False):
+        """Parse (path, source, sink, exchange) jobs.
+
+        Workers read the files themselves, so only paths cross the pipe.
+        """
+        return self._imap(_parsePriceVolumeFile, jobs, chunksize, ordered)
+
+    def imapPriceVolumeArchived(self, jobs, chunksize=1, ordered=False):
+        """Parse (archivePath, hash, source, sink, exchange) jobs.
+
+        Workers read and decompress the bodies themselves.
+        """
+        return self._imap(
+            _parsePriceVolumeArchived, jobs, chunksize, ordered)
+
+    def close(self):
+        """Wait for outstanding work and stop the worker processes."""
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        """Use the pool as a context manager."""
+        return self
+
+    def __exit__(self, *excInfo):
+        """Close the pool on leaving the context."""
+        self.close()
+
+
+class ParsePoolTest(unittest.TestCase):
+
+    """Testing suite for parsepool module."""
+
+    def setUp(self):
+        """Locate the example files."""
+        self.exampleDir = "{0}/example".format(
+            os.path.dirname(os.path.abspath(__file__)))
+        self.priceVolumeFile = "{0}/{1}".format(
+            self.exampleDir, "price_volume_usd_btc_btc-e_alltime_1h.json")
+
+    def testParsePriceVolume(self):
+        """Test pooled price / volume parsing."""
+        f = open(self.priceVolumeFile, 'r')
+        jsonDump = f.read()
+        f.close()
+        expected = cryptocoincharts.parsePriceVolume(
+            jsonDump, "usd", "btc", "btc-e")
+        with ParsePool(2) as pool:
+            parsed = pool.parsePriceVolume(jsonDump, "usd", "btc", "btc-e")
+            self.assertEqual(parsed.asDicts(), expected)
+            frames = list(pool.imapPriceVolumeFiles(
+                [(self.priceVolumeFile, "usd", "btc", "btc-e")] * 3))
+        self.assertEqual(len(frames), 3)
+        self.assertEqual(frames[0].asDicts(), expected)
+
+    def testParseExchange(self):
+        """Test pooled exchange page parsing."""
+        f = open("{0}/exchange_btc-e.html".format(self.exampleDir), 'r')
+        html = f.read()
+        f.close()
+        with ParsePool(1) as pool:
+            self.assertEqual(
+                pool.parseExchange(html), cryptocoincharts.parseExchange(html))
+
+if __name__ == "__main__":
+    unittest.main()
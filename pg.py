@@ -1,35 +1,88 @@
 """Module for storing cryptocoincharts data in the database."""
+import collections
+import contextlib
 import cryptocoincharts
 import datetime
 from decimal import Decimal
+import metrics
 import os
 import psycopg2 as pg2
 import psycopg2.extras as pg2ext
+import psycopg2.pool as pg2pool
 import random
+import threading
+import time
 import unittest
 
 # Configuration variables
 batchLimit = 1000
 targetTable = "exchange_pair_hour"
+dailyTable = "exchange_pair_day"
+loadMode = "diff"
+# Connections held by the pool, and so the most loads that run at once
+poolSize = 4
+# Set when targetTable uses sql/create_partitioned.sql, whose monthly
+# partitions are created by the loader as data arrives
+partitioned = False
+keyColumns = ["exchange", "source", "sink", "hour"]
+valueColumns = [
+    "price_low", "price_25th_percentile", "price_75th_percentile",
+    "price_high", "price_median", "price_ema20", "volume",
+    "field_7", "field_8"]
 
-# Pull in postgres configuration information
-# Pull in postgres configuration information
-dbcFile = open(
-    "{0}/.pgpass".format(os.path.dirname(os.path.abspath(__file__))),
-    'r')
-dbcRaw = dbcFile.readline().strip().split(':')
-dbcParams = {
-    'database': dbcRaw[2],
-    'user': dbcRaw[3],
-    'password': dbcRaw[4],
-    'host': dbcRaw[0],
-    'port': dbcRaw[1]
+# Rows fetched per round trip by readPriceVolume's server-side cursor,
+# and the number and lifetime of its cached results. The cache is per
+# process, so writes by other processes show up after readCacheSeconds.
+readItersize = 10000
+readCacheSize = 128
+readCacheSeconds = 300
+
+# Rollup tables kept current by every load, per date_trunc unit
+rollupTables = {
+    "day": "exchange_pair_day_rollup",
+    "week": "exchange_pair_week_rollup"
 }
-dbcFile.close()
+rollupColumns = [
+    "price_open", "price_high", "price_low", "price_close", "volume",
+    "field_7", "hours"]
+
+# Postgres configuration file, read on the first connect
+dbcPath = "{0}/.pgpass".format(os.path.dirname(os.path.abspath(__file__)))
+dbcParams = None
 
-# Connection variable
+# Connection variable, for ad hoc queries and schema changes
 conn = None
 
+# Pool of connections for concurrent transactions, opened on first use.
+# The semaphore makes borrowers wait for a free connection, where the
+# psycopg2 pool would raise.
+_pool = None
+_poolLock = threading.Lock()
+_poolSlots = None
+
+# readPriceVolume results, least recently used first. Loads bump the
+# generation, so a read that overlapped a load is not cached.
+_readCache = collections.OrderedDict()
+_readCacheLock = threading.Lock()
+_readCacheGeneration = 0
+
+
+def connectionParams():
+    """Return the connection parameters from .pgpass, reading it once."""
+    global dbcParams
+    if dbcParams is None:
+        dbcFile = open(dbcPath, 'r')
+        dbcRaw = dbcFile.readline().strip().split(':')
+        dbcFile.close()
+        dbcParams = {
+            'database': dbcRaw[2],
+            'user': dbcRaw[3],
+            'password': dbcRaw[4],
+            'host': dbcRaw[0],
+            'port': dbcRaw[1]
+        }
+    return dbcParams
+
 
 def connect():
     """Connect to the database."""
@@ -37,7 +90,7 @@ def connect():
     if conn is not None:
         return conn
     else:
-        conn = pg2.connect(**dbcParams)
+        conn = pg2.connect(**connectionParams())
         return conn
 
 
@@ -51,66 +104,613 @@ def dictCursor():
     return connect().cursor(cursor_factory=pg2ext.RealDictCursor)
 
 
-def loadPriceVolume(data):
-    """Load price volume data."""
-    cursor = dictCursor()
-
-    # Create staging table
-    stagingTable = "{0}_{1}".format(
-        targetTable, str(int(pow(10, random.random()*10))).zfill(10))
-    cursor.execute("""CREATE TABLE {0} (LIKE {1}
-        )""".format(stagingTable, targetTable))
-
-    # Move data into staging table
-    batchCount = 0
-    while batchCount*batchLimit < len(data):
-        cursor.executemany("""
-            INSERT INTO {0} (
-                exchange, source, sink, hour,
-                price_low, price_25th_percentile,
-                price_75th_percentile, price_high,
-                price_median, price_ema20, volume,
-                field_7, field_8)
-            VALUES (
-                %(exchange)s,
-                %(source)s,
-                %(sink)s,
-                %(hour)s,
-                %(price_low)s,
-                %(price_25th_percentile)s,
-                %(price_75th_percentile)s,
-                %(price_high)s,
-                %(price_median)s,
-                %(price_ema20)s,
-                %(volume)s,
-                %(field_7)s,
-                %(field_8)s
-            )
-            """.format(stagingTable),
-            data[(batchCount*batchLimit):((batchCount+1)*batchLimit)])
-        batchCount += 1
-
-    # Delete out rows with content similar to what we are about to insert
-    cursor.execute("""
-        DELETE FROM {0} as tgt
-        USING {1} as stg
-        WHERE tgt.exchange = stg.exchange
-        AND tgt.source = stg.source
-        AND tgt.sink = stg.sink
-        AND tgt.hour = stg.hour""".format(targetTable, stagingTable))
-
-    # Insert the new data into the target table
-    cursor.execute("""
-        INSERT INTO {0}
-        (SELECT *
-        FROM {1})""".format(targetTable, stagingTable))
-
-    # Drop the staging table
-    cursor.execute("""
-        DROP TABLE {0}""".format(stagingTable))
-
-    # Commmit the transaction
-    cursor.execute("COMMIT")
+def pool():
+    """Return the shared connection pool, creating it if needed."""
+    global _pool, _poolSlots
+    with _poolLock:
+        if _pool is None:
+            _poolSlots = threading.BoundedSemaphore(poolSize)
+            _pool = pg2pool.ThreadedConnectionPool(
+                0, poolSize, **connectionParams())
+        return _pool
+
+
+def closePool():
+    """Close every pooled connection."""
+    global _pool
+    with _poolLock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+@contextlib.contextmanager
+def transaction(name=None):
+    """Borrow a pooled connection and yield a dictionary cursor on it.
+
+    The transaction commits when the block exits and rolls back if it
+    raises, so a failed load never leaves an aborted connection behind.
+    Connections that broke are discarded instead of being returned. With
+    a name, the cursor is a server-side cursor of that name returning
+    tuples.
+    """
+    connectionPool = pool()
+    _poolSlots.acquire()
+    try:
+        connection = connectionPool.getconn()
+        broken = False
+        try:
+            if name is None:
+                yield connection.cursor(
+                    cursor_factory=pg2ext.RealDictCursor)
+            else:
+                yield connection.cursor(name)
+            connection.commit()
+        except Exception:
+            try:
+                connection.rollback()
+            except pg2.Error:
+                broken = True
+            raise
+        finally:
+            connectionPool.putconn(
+                connection, close=broken or bool(connection.closed))
+    finally:
+        _poolSlots.release()
+
+
+def createPartitionedTable(table, like):
+    """Create a table range partitioned on hour with the columns of like."""
+    with transaction() as cursor:
+        cursor.execute("""CREATE TABLE IF NOT EXISTS {0} (LIKE {1},
+            PRIMARY KEY ({2})) PARTITION BY RANGE (hour)""".format(
+            table, like, ", ".join(keyColumns)))
+        cursor.execute("""CREATE INDEX IF NOT EXISTS {0}_hour_brin
+            ON {0} USING BRIN (hour)""".format(table))
+
+
+def partitionName(month):
+    """Return the name of the targetTable partition holding a month."""
+    return "{0}_p{1}".format(targetTable, month.strftime("%Y%m"))
+
+
+def _loadTarget(data):
+    """Private method returning (table, time column) for a load.
+
+    Daily data, keyed by date, goes to dailyTable and hourly data to
+    targetTable.
+    """
+    timeColumn = getattr(data, "timeColumn", "hour")
+    if isinstance(data, list) and data:
+        first = data[0]
+        if hasattr(first, "asDict"):
+            first = first.asDict()
+        if first.get("date") is not None:
+            timeColumn = "date"
+    return (dailyTable if timeColumn == "date" else targetTable), timeColumn
+
+
+def _mergeTargets(cursor, stagingTable, table):
+    """Private method listing the tables a staged load is merged into.
+
+    Returns (table, lower, upper) tuples. Unpartitioned loads merge into
+    table without bounds; partitioned loads into targetTable create any
+    missing monthly partition and merge into each touched partition
+    directly, restricted to its range.
+    """
+    if not partitioned or table != targetTable:
+        return [(table, None, None)]
+    cursor.execute("""SELECT DISTINCT date_trunc('month', hour) AS month
+        FROM {0} ORDER BY month""".format(stagingTable))
+    targets = []
+    for row in cursor.fetchall():
+        lower = row["month"]
+        upper = (lower + datetime.timedelta(days=32)).replace(day=1)
+        # Concurrent loads creating the same partition queue on an
+        # advisory lock; loads into existing partitions take no lock
+        cursor.execute("SELECT to_regclass(%s) AS oid",
+                       (partitionName(lower),))
+        if cursor.fetchone()["oid"] is None:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))",
+                           (partitionName(lower),))
+            cursor.execute("""CREATE TABLE IF NOT EXISTS {0}
+                PARTITION OF {1} FOR VALUES FROM (%s) TO (%s)""".format(
+                partitionName(lower), targetTable), (lower, upper))
+        targets.append((partitionName(lower), lower, upper))
+    return targets
+
+
+def _rangeCondition(lower, upper, column="hour"):
+    """Private method returning (condition, params) bounding column."""
+    if lower is None:
+        return "TRUE", None
+    return "{0} >= %s AND {0} < %s".format(column), (lower, upper)
+
+
+def _rollupSql(unit, buckets):
+    """Private method building the upsert of one unit's rollup buckets.
+
+    buckets is a query returning the (exchange, source, sink, bucket) rows
+    to recompute from targetTable. Open and close are the first and last
+    hourly median price in a bucket.
+    """
+    return """
+        INSERT INTO {0} (exchange, source, sink, bucket, {1})
+        (SELECT b.exchange, b.source, b.sink, b.bucket,
+            (array_agg(h.price_median ORDER BY h.hour)
+                FILTER (WHERE h.price_median IS NOT NULL))[1],
+            max(h.price_high),
+            min(h.price_low),
+            (array_agg(h.price_median ORDER BY h.hour DESC)
+                FILTER (WHERE h.price_median IS NOT NULL))[1],
+            sum(h.volume),
+            sum(h.field_7),
+            count(*)
+        FROM ({2}) AS b
+        JOIN {3} AS h
+        ON h.exchange = b.exchange
+        AND h.source = b.source
+        AND h.sink = b.sink
+        AND h.hour >= b.bucket
+        AND h.hour < b.bucket + interval '1 {4}'
+        GROUP BY b.exchange, b.source, b.sink, b.bucket)
+        ON CONFLICT (exchange, source, sink, bucket)
+        DO UPDATE SET {5}""".format(
+        rollupTables[unit], ", ".join(rollupColumns), buckets, targetTable,
+        unit, ", ".join("{0} = EXCLUDED.{0}".format(column)
+                        for column in rollupColumns))
+
+
+def _touchedBuckets(unit, stagingTable):
+    """Private method returning the query for buckets a load touches."""
+    return """SELECT DISTINCT exchange, source, sink,
+        date_trunc('{0}', hour) AS bucket
+        FROM {1}""".format(unit, stagingTable)
+
+
+def _updateRollups(cursor, stagingTable):
+    """Private method recomputing the rollup buckets touched by a load.
+
+    Runs inside the load's transaction, after the merge.
+    """
+    for unit in sorted(rollupTables):
+        cursor.execute(_rollupSql(unit, _touchedBuckets(unit, stagingTable)))
+
+
+def rebuildRollups(units=None):
+    """Recompute every rollup bucket from targetTable.
+
+    Used once for data loaded before rollups existed; each unit is rebuilt
+    in its own transaction.
+    """
+    for unit in sorted(units or rollupTables):
+        with transaction() as cursor:
+            cursor.execute("TRUNCATE {0}".format(rollupTables[unit]))
+            cursor.execute(
+                _rollupSql(unit, _touchedBuckets(unit, targetTable)))
+
+
+def loadPriceVolume(data, mode=None):
+    """Load price volume data using the configured load mode.
+
+    Cached readPriceVolume results for the loaded pairs are dropped once
+    the load has finished.
+    """
+    try:
+        if (mode or loadMode) == "diff":
+            return diffPriceVolume(data)
+        elif (mode or loadMode) == "copy":
+            return copyPriceVolume(data)
+        else:
+            return stagePriceVolume(data)
+    finally:
+        invalidateReadCache(_loadTarget(data)[0], _dataPairs(data))
+
+
+def _dataPairs(data):
+    """Private method returning the (exchange, source, sink) pairs in data."""
+    if hasattr(data, "copyReader"):
+        return set([(data.exchange, data.source, data.sink)])
+    pairs = set()
+    for datum in data:
+        if hasattr(datum, "asDict"):
+            datum = datum.asDict()
+        pairs.add((datum.get("exchange"), datum.get("source"),
+                   datum.get("sink")))
+    return pairs
+
+
+def invalidateReadCache(table=None, pairs=None):
+    """Drop cached reads of some pairs of a table, or of everything."""
+    global _readCacheGeneration
+    with _readCacheLock:
+        _readCacheGeneration += 1
+        for key in list(_readCache):
+            if table is not None and key[0] != table:
+                continue
+            if pairs is not None and key[1:4] not in pairs:
+                continue
+            del _readCache[key]
+
+
+def _readCacheGet(key):
+    """Private method returning a fresh cached read, or None."""
+    with _readCacheLock:
+        entry = _readCache.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > readCacheSeconds:
+            del _readCache[key]
+            return None
+        _readCache.pop(key)
+        _readCache[key] = entry
+        return entry[1]
+
+
+def _readCachePut(key, value, generation):
+    """Private method caching a read unless a load overlapped it."""
+    with _readCacheLock:
+        if readCacheSize <= 0 or generation != _readCacheGeneration:
+            return
+        _readCache.pop(key, None)
+        _readCache[key] = (time.time(), value)
+        while len(_readCache) > readCacheSize:
+            _readCache.popitem(last=False)
+
+
+def readPriceVolume(exchange, source, sink, start=None, end=None,
+                    resolution="1h"):
+    """Read one pair's price volume series as a PriceVolumeFrame.
+
+    Rows from start, inclusive, to end, exclusive, are streamed through a
+    server-side cursor readItersize rows at a time and returned as
+    float64 arrays, with NaN for NULL. resolution "1d" reads dailyTable.
+    Results are cached; their arrays are read-only because cache hits
+    return the same frame.
+    """
+    import frame
+    import numpy as np
+    table, timeColumn, timeUnit = targetTable, "hour", "datetime64[h]"
+    if resolution == "1d":
+        table, timeColumn, timeUnit = dailyTable, "date", "datetime64[D]"
+    key = (table, exchange, source, sink, start, end)
+    cached = _readCacheGet(key)
+    if cached is not None:
+        metrics.count("read_cache", result="hit")
+        return cached
+    metrics.count("read_cache", result="miss")
+    with _readCacheLock:
+        generation = _readCacheGeneration
+
+    conditions = ["exchange = %s", "source = %s", "sink = %s"]
+    params = [exchange, source, sink]
+    if start is not None:
+        conditions.append("{0} >= %s".format(timeColumn))
+        params.append(start)
+    if end is not None:
+        conditions.append("{0} < %s".format(timeColumn))
+        params.append(end)
+    chunks = []
+    with metrics.timer("read_seconds", table=table):
+        with transaction("read_price_volume") as cursor:
+            cursor.itersize = readItersize
+            cursor.execute("""
+                SELECT extract(epoch FROM {1})::float8, {2}
+                FROM {0}
+                WHERE {3}
+                ORDER BY {1}""".format(
+                table, timeColumn,
+                ", ".join("{0}::float8".format(column)
+                          for column in valueColumns),
+                " AND ".join(conditions)), params)
+            while True:
+                rows = cursor.fetchmany(readItersize)
+                if not rows:
+                    break
+                chunks.append(np.array(rows, dtype=np.float64))
+    values = np.concatenate(chunks) if chunks else np.empty(
+        (0, len(valueColumns) + 1))
+    metrics.count("read_rows", len(values), table=table)
+
+    hour = values[:, 0].astype("int64").astype("datetime64[s]").astype(
+        timeUnit)
+    columns = dict(
+        (column, np.ascontiguousarray(values[:, columnNum + 1]))
+        for columnNum, column in enumerate(valueColumns))
+    for array in [hour] + list(columns.values()):
+        array.flags.writeable = False
+    result = frame.PriceVolumeFrame(source, sink, exchange, hour, columns)
+    _readCachePut(key, result, generation)
+    return result
+
+
+def loadPriceVolumeParallel(dataList, workers=None, mode=None):
+    """Load the data of many pairs concurrently over pooled connections.
+
+    Each pair is loaded in its own transaction by one of up to workers
+    threads, poolSize by default. Yields (data, result, error) tuples in
+    the order the loads finish, where error is the exception a failed
+    load raised and rolled back on, or None.
+    """
+    for args, result, error in cryptocoincharts.requestBatch(
+            loadPriceVolume, [(data, mode) for data in dataList],
+            min(workers or poolSize, poolSize)):
+        yield args[0], result, error
+
+
+def _copyValue(value):
+    """Private method formatting a value for COPY text format."""
+    if value is None:
+        return "\\N"
+    elif isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    elif isinstance(value, float):
+        return repr(value)
+    else:
+        return str(value).replace("\\", "\\\\").replace(
+            "\t", "\\t").replace("\n", "\\n")
+
+
+class _CopyReader(object):
+
+    """File-like object streaming rows in COPY text format."""
+
+    def __init__(self, rows, columns):
+        """Wrap an iterable of row dictionaries."""
+        self.rows = iter(rows)
+        self.columns = columns
+        self.buffer = ""
+        self.count = 0
+
+    def readline(self, size=-1):
+        """Return the next formatted row."""
+        row = next(self.rows, None)
+        if row is None:
+            return ""
+        self.count += 1
+        return "\t".join(
+            _copyValue(row[column]) for column in self.columns) + "\n"
+
+    def read(self, size=-1):
+        """Return up to size characters of formatted rows."""
+        while size < 0 or len(self.buffer) < size:
+            line = self.readline()
+            if line == "":
+                break
+            self.buffer += line
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def _copyToStaging(cursor, data, mode):
+    """Private method streaming data into a session-local staging table.
+
+    Returns the target table, its key columns, the loaded columns, the
+    staging table and the number of rows copied.
+    """
+    table, timeColumn = _loadTarget(data)
+    pairKeyColumns = keyColumns[:3] + [timeColumn]
+    columns = pairKeyColumns + valueColumns
+    stagingTable = "{0}_copy".format(table)
+
+    with metrics.timer("load_seconds", mode=mode, step="staging"):
+        # Reusable session-local staging table, emptied on every commit
+        cursor.execute("""CREATE TEMP TABLE IF NOT EXISTS {0} (LIKE {1})
+            ON COMMIT DELETE ROWS""".format(stagingTable, table))
+
+        # Stream the rows into the staging table
+        if hasattr(data, "copyReader"):
+            reader = data.copyReader(columns)
+        else:
+            reader = _CopyReader(data, columns)
+        cursor.copy_expert("COPY {0} ({1}) FROM STDIN".format(
+            stagingTable, ", ".join(columns)), reader)
+    rowCount = len(data) if hasattr(data, "copyReader") else reader.count
+    return table, pairKeyColumns, columns, stagingTable, rowCount
+
+
+def copyPriceVolume(data):
+    """Load price volume data via COPY into a temp table and upsert.
+
+    Accepts a list of row dictionaries, PriceVolumeRow records or a
+    PriceVolumeFrame, hourly or daily.
+    """
+    with transaction() as cursor:
+        table, pairKeyColumns, columns, stagingTable, rowCount = \
+            _copyToStaging(cursor, data, "copy")
+
+        # Merge into the target table, or each touched partition, under its
+        # unique key
+        with metrics.timer("load_seconds", mode="copy", step="insert"):
+            for mergeTable, lower, upper in _mergeTargets(
+                    cursor, stagingTable, table):
+                condition, params = _rangeCondition(lower, upper)
+                cursor.execute("""
+                    INSERT INTO {0} ({2})
+                    (SELECT DISTINCT ON ({3}) {2}
+                    FROM {1}
+                    WHERE {5})
+                    ON CONFLICT ({3}) DO UPDATE SET {4}""".format(
+                    mergeTable, stagingTable, ", ".join(columns),
+                    ", ".join(pairKeyColumns),
+                    ", ".join("{0} = EXCLUDED.{0}".format(column)
+                              for column in valueColumns), condition), params)
+
+        # Recompute the rollup buckets touched by the staged hourly rows
+        if table == targetTable:
+            with metrics.timer("load_seconds", mode="copy", step="rollup"):
+                _updateRollups(cursor, stagingTable)
+
+        # Commit the transaction
+        with metrics.timer("load_seconds", mode="copy", step="commit"):
+            cursor.connection.commit()
+    metrics.count("load_rows", rowCount, mode="copy")
+
+    # Return
+    return True
+
+
+def diffPriceVolume(data):
+    """Load price volume data via COPY, writing only new or changed rows.
+
+    Rows whose stored values are identical are left untouched, so they
+    cause no new row versions, WAL or index updates. Returns a dictionary
+    mapping (exchange, source, sink) to its inserted, updated and
+    unchanged row counts.
+    """
+    with transaction() as cursor:
+        table, pairKeyColumns, columns, stagingTable, rowCount = \
+            _copyToStaging(cursor, data, "diff")
+
+        # Merge under the unique key, skipping updates that change nothing;
+        # xmax is 0 only for freshly inserted row versions
+        changes = {}
+        with metrics.timer("load_seconds", mode="diff", step="insert"):
+            for mergeTable, lower, upper in _mergeTargets(
+                    cursor, stagingTable, table):
+                condition, params = _rangeCondition(lower, upper)
+                cursor.execute("""
+                    WITH merged AS (
+                        INSERT INTO {0} AS tgt ({2})
+                        (SELECT DISTINCT ON ({3}) {2}
+                        FROM {1}
+                        WHERE {5})
+                        ON CONFLICT ({3}) DO UPDATE SET {4}
+                        WHERE ({6}) IS DISTINCT FROM ({7})
+                        RETURNING exchange, source, sink, xmax = 0 AS inserted)
+                    SELECT exchange, source, sink,
+                        count(*) FILTER (WHERE inserted) AS inserted,
+                        count(*) FILTER (WHERE NOT inserted) AS updated
+                    FROM merged
+                    GROUP BY exchange, source, sink""".format(
+                    mergeTable, stagingTable, ", ".join(columns),
+                    ", ".join(pairKeyColumns),
+                    ", ".join("{0} = EXCLUDED.{0}".format(column)
+                              for column in valueColumns), condition,
+                    ", ".join("tgt.{0}".format(column)
+                              for column in valueColumns),
+                    ", ".join("EXCLUDED.{0}".format(column)
+                              for column in valueColumns)), params)
+                for row in cursor.fetchall():
+                    counts = changes.setdefault(
+                        (row["exchange"], row["source"], row["sink"]),
+                        {"inserted": 0, "updated": 0})
+                    counts["inserted"] += row["inserted"]
+                    counts["updated"] += row["updated"]
+
+            # Whatever was staged but neither inserted nor updated is unchanged
+            cursor.execute("""SELECT exchange, source, sink,
+                    count(DISTINCT {1}) AS staged
+                FROM {0}
+                GROUP BY exchange, source, sink""".format(
+                stagingTable, pairKeyColumns[-1]))
+            for row in cursor.fetchall():
+                counts = changes.setdefault(
+                    (row["exchange"], row["source"], row["sink"]),
+                    {"inserted": 0, "updated": 0})
+                counts["unchanged"] = \
+                    row["staged"] - counts["inserted"] - counts["updated"]
+
+        # Recompute rollups only if some hourly row changed
+        changed = sum(counts["inserted"] + counts["updated"]
+                      for counts in changes.values())
+        if table == targetTable and changed:
+            with metrics.timer("load_seconds", mode="diff", step="rollup"):
+                _updateRollups(cursor, stagingTable)
+
+        # Commit the transaction
+        with metrics.timer("load_seconds", mode="diff", step="commit"):
+            cursor.connection.commit()
+    metrics.count("load_rows", rowCount, mode="diff")
+    for change in ("inserted", "updated", "unchanged"):
+        metrics.count("load_changed_rows", sum(
+            counts[change] for counts in changes.values()), change=change)
+
+    # Return
+    return changes
+
+
+def stagePriceVolume(data):
+    """Load price volume data through a staging table and executemany."""
+    table, timeColumn = _loadTarget(data)
+    if hasattr(data, "asDicts"):
+        data = data.asDicts()
+    with transaction() as cursor:
+        with metrics.timer("load_seconds", mode="staging", step="staging"):
+            # Create staging table
+            stagingTable = "{0}_{1}".format(
+                table, str(int(pow(10, random.random()*10))).zfill(10))
+            cursor.execute("""CREATE TABLE {0} (LIKE {1}
+                )""".format(stagingTable, table))
+
+            # Move data into staging table
+            batchCount = 0
+            while batchCount*batchLimit < len(data):
+                cursor.executemany("""
+                    INSERT INTO {0} (
+                        exchange, source, sink, {1},
+                        price_low, price_25th_percentile,
+                        price_75th_percentile, price_high,
+                        price_median, price_ema20, volume,
+                        field_7, field_8)
+                    VALUES (
+                        %(exchange)s,
+                        %(source)s,
+                        %(sink)s,
+                        %({1})s,
+                        %(price_low)s,
+                        %(price_25th_percentile)s,
+                        %(price_75th_percentile)s,
+                        %(price_high)s,
+                        %(price_median)s,
+                        %(price_ema20)s,
+                        %(volume)s,
+                        %(field_7)s,
+                        %(field_8)s
+                    )
+                    """.format(stagingTable, timeColumn),
+                    data[(batchCount*batchLimit):((batchCount+1)*batchLimit)])
+                batchCount += 1
+
+        # Delete out rows with content similar to what we are about to insert
+        mergeTargets = _mergeTargets(cursor, stagingTable, table)
+        with metrics.timer("load_seconds", mode="staging", step="delete"):
+            for mergeTable, lower, upper in mergeTargets:
+                condition, params = _rangeCondition(lower, upper, "stg.hour")
+                cursor.execute("""
+                    DELETE FROM {0} as tgt
+                    USING {1} as stg
+                    WHERE tgt.exchange = stg.exchange
+                    AND tgt.source = stg.source
+                    AND tgt.sink = stg.sink
+                    AND tgt.{3} = stg.{3}
+                    AND {2}""".format(
+                    mergeTable, stagingTable, condition, timeColumn), params)
+
+        # Insert the new data into the target table
+        with metrics.timer("load_seconds", mode="staging", step="insert"):
+            for mergeTable, lower, upper in mergeTargets:
+                condition, params = _rangeCondition(lower, upper)
+                cursor.execute("""
+                    INSERT INTO {0}
+                    (SELECT *
+                    FROM {1}
+                    WHERE {2})""".format(mergeTable, stagingTable, condition),
+                    params)
+
+        # Recompute the rollup buckets touched by the staged hourly rows
+        if table == targetTable:
+            with metrics.timer("load_seconds", mode="staging", step="rollup"):
+                _updateRollups(cursor, stagingTable)
+
+        # Drop the staging table and commit the transaction
+        with metrics.timer("load_seconds", mode="staging", step="commit"):
+            cursor.execute("""
+                DROP TABLE {0}""".format(stagingTable))
+            cursor.connection.commit()
+    metrics.count("load_rows", len(data), mode="staging")
 
     # Return
     return True
@@ -129,27 +729,51 @@ class PgTest(unittest.TestCase):
         global batchLimit
         self.batchLimitOriginal = batchLimit
         batchLimit = 1000
+        global dailyTable
+        self.dailyTableOriginal = dailyTable
+        dailyTable = "{0}_test".format(self.dailyTableOriginal)
+        global rollupTables
+        self.rollupTablesOriginal = rollupTables
+        rollupTables = dict(
+            (unit, "{0}_test".format(table))
+            for unit, table in self.rollupTablesOriginal.items())
 
         # Create test tables
         cursor = dictCursor()
         cursor.execute("""CREATE TABLE IF NOT EXISTS
             {0} (LIKE {1} INCLUDING ALL)""".format(
             targetTable, self.targetTableOriginal))
+        cursor.execute("""CREATE TABLE IF NOT EXISTS
+            {0} (LIKE {1} INCLUDING ALL)""".format(
+            dailyTable, self.dailyTableOriginal))
+        for unit, table in rollupTables.items():
+            cursor.execute("""CREATE TABLE IF NOT EXISTS
+                {0} (LIKE {1} INCLUDING ALL)""".format(
+                table, self.rollupTablesOriginal[unit]))
         cursor.execute("""COMMIT""")
 
     def tearDown(self):
         """Teardown test tables."""
         # Drop test tables
         global targetTable
+        global dailyTable
+        global rollupTables
         cursor = dictCursor()
         cursor.execute("""DROP TABLE IF EXISTS
             {0}""".format(targetTable))
+        cursor.execute("""DROP TABLE IF EXISTS
+            {0}""".format(dailyTable))
+        for table in rollupTables.values():
+            cursor.execute("""DROP TABLE IF EXISTS
+                {0}""".format(table))
         cursor.execute("""COMMIT""")
 
         # Undo swap / sub
         targetTable = self.targetTableOriginal
+        dailyTable = self.dailyTableOriginal
         global batchLimit
         batchLimit = self.batchLimitOriginal
+        rollupTables = self.rollupTablesOriginal
 
     def testLoadPriceVolumeLogic(self):
         """Test loadPriceVolume function - Part 1."""
@@ -288,5 +912,244 @@ class PgTest(unittest.TestCase):
             jsonDump, "usd", "btc", "btc-e")
         loadPriceVolume(data)
 
+    def testLoadModesAgree(self):
+        """Test every load mode produces the same table."""
+        data = cryptocoincharts.parsePriceVolume(
+            open("{0}/example/price_volume_usd_btc_btc-e_alltime_1h.json"
+                 .format(os.path.dirname(os.path.abspath(__file__))),
+                 'r').read(), "usd", "btc", "btc-e")
+        query = "SELECT * FROM {0} ORDER BY hour".format(targetTable)
+        cursor = dictCursor()
+        loadPriceVolume(data, mode="staging")
+        cursor.execute(query)
+        staged = cursor.fetchall()
+        cursor.execute("TRUNCATE {0}; COMMIT".format(targetTable))
+        loadPriceVolume(data, mode="copy")
+        loadPriceVolume(data[-10:], mode="copy")
+        cursor.execute(query)
+        self.assertEqual(cursor.fetchall(), staged)
+        cursor.execute("TRUNCATE {0}; COMMIT".format(targetTable))
+        loadPriceVolume(data, mode="diff")
+        loadPriceVolume(data[-10:], mode="diff")
+        cursor.execute(query)
+        self.assertEqual(cursor.fetchall(), staged)
+
+    def testDiffCounts(self):
+        """Test the diff load mode reports and writes only changes."""
+        data = cryptocoincharts.parsePriceVolume(
+            open("{0}/example/price_volume_usd_btc_btc-e_alltime_1h.json"
+                 .format(os.path.dirname(os.path.abspath(__file__))),
+                 'r').read(), "usd", "btc", "btc-e")
+        key = ("btc-e", "usd", "btc")
+        self.assertEqual(diffPriceVolume(data[:-5])[key], {
+            "inserted": len(data) - 5, "updated": 0, "unchanged": 0})
+        cursor = dictCursor()
+        cursor.execute("SELECT ctid FROM {0} WHERE hour = %s".format(
+            targetTable), (data[-6]["hour"],))
+        unchangedLocation = cursor.fetchone()["ctid"]
+        cursor.execute("COMMIT")
+        window = [dict(datum) for datum in data[-240:]]
+        window[-10]["volume"] = 1.5
+        self.assertEqual(diffPriceVolume(window)[key], {
+            "inserted": 5, "updated": 1, "unchanged": 234})
+        cursor.execute("SELECT ctid FROM {0} WHERE hour = %s".format(
+            targetTable), (data[-6]["hour"],))
+        self.assertEqual(cursor.fetchone()["ctid"], unchangedLocation)
+        cursor.execute("COMMIT")
+
+    def testDailyLoad(self):
+        """Test daily data is loaded into the daily table."""
+        import frame
+        jsonDump = """[
+            ["2014-07-20",600,605,610,615,607,2100,1274700,0,606.5],
+            ["2014-07-21",610,612,616,620,614,3000.5,1842307.2,0,613.9]]"""
+        cursor = dictCursor()
+        loadPriceVolume(cryptocoincharts.parsePriceVolume(
+            jsonDump, "usd", "btc", "btc-e"), mode="staging")
+        loadPriceVolume(frame.PriceVolumeFrame.fromJson(
+            jsonDump, "usd", "btc", "btc-e"), mode="copy")
+        cursor.execute("SELECT * FROM {0} ORDER BY date".format(dailyTable))
+        rows = cursor.fetchall()
+        self.assertEqual([row["date"] for row in rows], [
+            datetime.date(2014, 7, 20), datetime.date(2014, 7, 21)])
+        self.assertEqual(rows[1]["volume"], Decimal("3000.5"))
+        cursor.execute("SELECT count(*) AS rows FROM {0}".format(targetTable))
+        self.assertEqual(cursor.fetchone()["rows"], 0)
+
+    def testRollups(self):
+        """Test incremental rollups match a rebuild from scratch."""
+        data = cryptocoincharts.parsePriceVolume(
+            open("{0}/example/price_volume_usd_btc_btc-e_alltime_1h.json"
+                 .format(os.path.dirname(os.path.abspath(__file__))),
+                 'r').read(), "usd", "btc", "btc-e")
+        cursor = dictCursor()
+        loadPriceVolume(data[:5000], mode="copy")
+        loadPriceVolume(data[4990:], mode="staging")
+        incremental = {}
+        for unit, table in rollupTables.items():
+            cursor.execute("SELECT * FROM {0} ORDER BY bucket".format(table))
+            incremental[unit] = cursor.fetchall()
+        cursor.execute("COMMIT")
+        rebuildRollups()
+        for unit, table in rollupTables.items():
+            cursor.execute("SELECT * FROM {0} ORDER BY bucket".format(table))
+            self.assertEqual(cursor.fetchall(), incremental[unit])
+        cursor.execute("""SELECT sum(hours) AS hours
+            FROM {0}""".format(rollupTables["week"]))
+        self.assertEqual(cursor.fetchone()["hours"], len(data))
+
+    def testTransaction(self):
+        """Test a failed transaction rolls back and frees its connection."""
+        global poolSize
+        poolSizeOriginal = poolSize
+        closePool()
+        poolSize = 1
+        try:
+            with self.assertRaises(pg2.Error):
+                with transaction() as cursor:
+                    cursor.execute("""INSERT INTO {0}
+                        (exchange, source, sink, hour)
+                        VALUES ('btc-e', 'usd', 'btc', '2014-07-22 15:00')
+                        """.format(targetTable))
+                    cursor.execute("SELECT 1 / 0")
+            with transaction() as cursor:
+                cursor.execute("SELECT count(*) AS rows FROM {0}".format(
+                    targetTable))
+                self.assertEqual(cursor.fetchone()["rows"], 0)
+        finally:
+            closePool()
+            poolSize = poolSizeOriginal
+
+    def testParallelLoad(self):
+        """Test parallel loads match loading pair by pair."""
+        import frame
+        dataFrame = frame.PriceVolumeFrame.fromJson(
+            open("{0}/example/price_volume_usd_btc_btc-e_alltime_1h.json"
+                 .format(os.path.dirname(os.path.abspath(__file__))),
+                 'r').read(), "usd", "btc", "btc-e")
+        frames = [frame.PriceVolumeFrame(
+            "usd", "btc", "exchange-{0}".format(pairNum), dataFrame.hour,
+            dataFrame.columns) for pairNum in range(6)]
+        frames.append([{"exchange": "broken"}])
+        results = list(loadPriceVolumeParallel(frames, workers=3))
+        self.assertEqual(len(results), len(frames))
+        self.assertEqual(
+            [data for data, result, error in results if error is not None],
+            [frames[-1]])
+        cursor = dictCursor()
+        cursor.execute("""SELECT exchange, count(*) AS rows
+            FROM {0}
+            GROUP BY exchange
+            ORDER BY exchange""".format(targetTable))
+        self.assertEqual(
+            [(row["exchange"], row["rows"]) for row in cursor.fetchall()],
+            [("exchange-{0}".format(pairNum), len(dataFrame))
+             for pairNum in range(6)])
+        cursor.execute("COMMIT")
+
+    def testReadPriceVolume(self):
+        """Test reads match the loaded data and are cached until a load."""
+        import frame
+        import numpy as np
+        dataFrame = frame.PriceVolumeFrame.fromJson(
+            open("{0}/example/price_volume_usd_btc_btc-e_alltime_1h.json"
+                 .format(os.path.dirname(os.path.abspath(__file__))),
+                 'r').read(), "usd", "btc", "btc-e")
+        loadPriceVolume(dataFrame)
+        start = datetime.datetime(2014, 1, 1)
+        end = datetime.datetime(2014, 2, 1)
+        series = readPriceVolume("btc-e", "usd", "btc", start, end)
+        inRange = (dataFrame.hour >= np.datetime64(start, "h")) & (
+            dataFrame.hour < np.datetime64(end, "h"))
+        self.assertEqual(series.hour.tolist(),
+                         dataFrame.hour[inRange].tolist())
+        for column in valueColumns:
+            np.testing.assert_allclose(
+                series[column], dataFrame[column][inRange], rtol=1e-9)
+        self.assertTrue(
+            readPriceVolume("btc-e", "usd", "btc", start, end) is series)
+        self.assertEqual(len(readPriceVolume("btc-e", "usd", "ltc")), 0)
+
+        # A load of the pair drops its cached reads
+        changed = [dict(datum) for datum in dataFrame.asDicts()
+                   if datum["hour"] == start]
+        changed[0]["volume"] = 1.5
+        loadPriceVolume(changed)
+        reread = readPriceVolume("btc-e", "usd", "btc", start, end)
+        self.assertFalse(reread is series)
+        self.assertEqual(reread.volume[0], 1.5)
+
+    def testPartitionedLoad(self):
+        """Test loads into monthly partitions match unpartitioned loads."""
+        global targetTable, partitioned
+        data = cryptocoincharts.parsePriceVolume(
+            open("{0}/example/price_volume_usd_btc_btc-e_alltime_1h.json"
+                 .format(os.path.dirname(os.path.abspath(__file__))),
+                 'r').read(), "usd", "btc", "btc-e")
+        query = "SELECT * FROM {0} ORDER BY hour"
+        cursor = dictCursor()
+        loadPriceVolume(data)
+        cursor.execute(query.format(targetTable))
+        flat = cursor.fetchall()
+        flatTable = targetTable
+        targetTable = "{0}_part".format(flatTable)
+        partitioned = True
+        try:
+            createPartitionedTable(targetTable, flatTable)
+            for mode in ("copy", "staging"):
+                loadPriceVolume(data, mode=mode)
+                loadPriceVolume(data[-10:], mode=mode)
+                cursor.execute(query.format(targetTable))
+                self.assertEqual(cursor.fetchall(), flat)
+            cursor.execute("""SELECT count(*) AS partitions
+                FROM pg_inherits
+                WHERE inhparent = %s::regclass""", (targetTable,))
+            self.assertEqual(cursor.fetchone()["partitions"], 14)
+        finally:
+            cursor.execute("ROLLBACK")
+            cursor.execute("DROP TABLE IF EXISTS {0} CASCADE; COMMIT".format(
+                targetTable))
+            targetTable = flatTable
+            partitioned = False
+
+
+class ReadCacheTest(unittest.TestCase):
+
+    """Testing suite for the readPriceVolume cache."""
+
+    def setUp(self):
+        """Start from an empty cache."""
+        global readCacheSize
+        self.readCacheSizeOriginal = readCacheSize
+        readCacheSize = 2
+        invalidateReadCache()
+
+    def tearDown(self):
+        """Leave an empty cache behind."""
+        global readCacheSize
+        readCacheSize = self.readCacheSizeOriginal
+        invalidateReadCache()
+
+    def testEviction(self):
+        """Test least recently used and overlapped reads are not kept."""
+        keys = [(targetTable, "btc-e", "usd", sink, None, None)
+                for sink in ("btc", "ltc", "nmc")]
+        _readCachePut(keys[0], "btc", _readCacheGeneration)
+        _readCachePut(keys[1], "ltc", _readCacheGeneration)
+        self.assertEqual(_readCacheGet(keys[0]), "btc")
+        _readCachePut(keys[2], "nmc", _readCacheGeneration)
+        self.assertEqual(_readCacheGet(keys[1]), None)
+        self.assertEqual(_readCacheGet(keys[0]), "btc")
+
+        # Loads of other pairs or tables leave an entry alone
+        generation = _readCacheGeneration
+        invalidateReadCache(dailyTable, set([("btc-e", "usd", "btc")]))
+        invalidateReadCache(targetTable, set([("btc-e", "usd", "ltc")]))
+        self.assertEqual(_readCacheGet(keys[0]), "btc")
+        invalidateReadCache(targetTable, set([("btc-e", "usd", "btc")]))
+        self.assertEqual(_readCacheGet(keys[0]), None)
+        _readCachePut(keys[0], "stale", generation)
+        self.assertEqual(_readCacheGet(keys[0]), None)
+
 if __name__ == "__main__":
     unittest.main()
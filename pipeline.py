@@ -0,0 +1,180 @@
+"""Staged, threaded pipeline with bounded queues between the stages."""
+import logging
+import threading
+import time
+import unittest
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# Marker telling a stage worker that no more items will arrive
+_done = object()
+
+
+class Stage(object):
+
+    """One pipeline stage: a function run by a number of worker threads.
+
+    The function receives an item and returns the item for the next stage;
+    returning None drops the item. Exceptions are logged and counted.
+    """
+
+    def __init__(self, name, func, workers=1, queueSize=16):
+        """Describe a stage and its input queue bound."""
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queueSize = queueSize
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.errors = 0
+        self.busyTime = 0.0
+        self.depthTotal = 0
+        self.depthSamples = 0
+        self.maxDepth = 0
+
+    def _record(self, depth, elapsed, failed):
+        """Private method updating the stage statistics."""
+        with self.lock:
+            self.processed += 1
+            self.errors += 1 if failed else 0
+            self.busyTime += elapsed
+            self.depthTotal += depth
+            self.depthSamples += 1
+            self.maxDepth = max(self.maxDepth, depth)
+
+    def stats(self, wallTime):
+        """Return the stage statistics for a run lasting wallTime."""
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "processed": self.processed,
+            "errors": self.errors,
+            "items_per_sec": self.processed / wallTime if wallTime else None,
+            "utilization": self.busyTime / (wallTime * self.workers)
+            if wallTime else None,
+            "avg_queue_depth": float(self.depthTotal) / self.depthSamples
+            if self.depthSamples else 0.0,
+            "max_queue_depth": self.maxDepth
+        }
+
+
+class Pipeline(object):
+
+    """Chain of stages connected by bounded queues.
+
+    A full queue blocks the stage feeding it, so a slow stage throttles
+    everything upstream of it instead of buffering without limit.
+    """
+
+    def __init__(self, stages):
+        """Connect the given stages in order."""
+        self.stages = stages
+        self.queues = [queue.Queue(stage.queueSize) for stage in stages]
+        self.wallTime = None
+
+    def _work(self, stageNum, remaining):
+        """Private method run by every worker thread of a stage."""
+        stage = self.stages[stageNum]
+        inbox = self.queues[stageNum]
+        outbox = None
+        if stageNum + 1 < len(self.stages):
+            outbox = self.queues[stageNum + 1]
+        while True:
+            depth = inbox.qsize()
+            item = inbox.get()
+            if item is _done:
+                break
+            start = time.time()
+            failed = False
+            try:
+                result = stage.func(item)
+            except Exception:
+                logging.exception("Stage {0} failed for item {1!r}.".format(
+                    stage.name, item))
+                failed = True
+                result = None
+            stage._record(depth, time.time() - start, failed)
+            if outbox is not None and result is not None:
+                outbox.put(result)
+
+        # The last worker of a stage to finish shuts down the next stage
+        with stage.lock:
+            remaining[stageNum] -= 1
+            last = remaining[stageNum] == 0
+        if last and outbox is not None:
+            for _ in range(self.stages[stageNum + 1].workers):
+                outbox.put(_done)
+
+    def run(self, items):
+        """Feed items through every stage and wait for completion."""
+        start = time.time()
+        remaining = [stage.workers for stage in self.stages]
+        threads = []
+        for stageNum, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work, args=(stageNum, remaining))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        for item in items:
+            self.queues[0].put(item)
+        for _ in range(self.stages[0].workers):
+            self.queues[0].put(_done)
+        for thread in threads:
+            thread.join()
+        self.wallTime = time.time() - start
+        return self.stats()
+
+    def stats(self):
+        """Return per-stage statistics of the last run."""
+        return [stage.stats(self.wallTime) for stage in self.stages]
+
+
+def logStats(stats):
+    """Log per-stage throughput and queue depth."""
+    for stageStats in stats:
+        logging.info("Stage {stage}: {processed} items ({errors} errors) \
+            with {workers} worker(s), {items_per_sec:.2f} items/sec, \
+            {utilization:.0%} busy, queue depth avg {avg_queue_depth:.1f} \
+            max {max_queue_depth}.".format(**stageStats))
+
+
+class PipelineTest(unittest.TestCase):
+
+    """Testing suite for pipeline module."""
+
+    def testRun(self):
+        """Test stages overlap and results reach the last stage."""
+        results = []
+
+        def slow(item):
+            time.sleep(0.02)
+            return item
+
+        def fail(item):
+            if item == 3:
+                raise ValueError(item)
+            return item * 10
+
+        stages = [
+            Stage("fetch", slow, workers=2, queueSize=2),
+            Stage("parse", fail, queueSize=2),
+            Stage("load", lambda item: results.append(item) or item,
+                  queueSize=2)
+        ]
+        pipeline = Pipeline(stages)
+        stats = pipeline.run(range(10))
+        self.assertEqual(
+            sorted(results), [0, 10, 20, 40, 50, 60, 70, 80, 90])
+        self.assertEqual(stats[0]["processed"], 10)
+        self.assertEqual(stats[1]["errors"], 1)
+        self.assertEqual(stats[2]["processed"], 9)
+        self.assertTrue(max(stat["max_queue_depth"] for stat in stats) <= 2)
+        self.assertTrue(pipeline.wallTime < 10 * 0.02)
+
+if __name__ == "__main__":
+    unittest.main()
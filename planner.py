@@ -0,0 +1,284 @@
+"""Incremental fetch planning driven by per-pair high-water marks."""
+import datetime
+import logging
+import unittest
+
+# Windows accepted by the "time" parameter of requestPriceVolume, smallest
+# first, with the number of hours each one covers
+timeWindows = [
+    ("24h", 24),
+    ("3d", 72),
+    ("7d", 168),
+    ("10d", 240),
+    ("30d", 720)
+]
+allTime = "alltime"
+
+# Window the unplanned scraper requests for every known pair
+baselineTime = "10d"
+
+# Longest history fetched at hourly resolution; anything older comes from
+# one alltime request at daily resolution. None fetches alltime hourly.
+hourlyHistoryTime = "30d"
+hourlyResolution = "1h"
+dailyResolution = "1d"
+
+# Holes older than this many hours are not refetched; the site itself has
+# gaps for hours without trades, so this bounds repeated refetching
+gapLookbackHours = 240
+
+# Average size of one hourly row in a period.php dump
+bytesPerRow = 85
+
+
+def _pairKey(exchange, source, sink):
+    """Private method building the dictionary key for a pair."""
+    return (exchange, source, sink)
+
+
+def readHighWaterMarks(cursor, table="exchange_pair_hour"):
+    """Read the latest stored hour for every pair."""
+    cursor.execute("""SELECT exchange, source, sink, MAX(hour) AS "last_hour"
+        FROM {0}
+        GROUP BY exchange, source, sink""".format(table))
+    return dict(
+        (_pairKey(row["exchange"], row["source"], row["sink"]),
+         row["last_hour"]) for row in cursor.fetchall())
+
+
+def readGaps(cursor, since, table="exchange_pair_hour"):
+    """Read missing hour ranges per pair for hours after since."""
+    cursor.execute("""SELECT exchange, source, sink,
+            prev_hour + INTERVAL '1 hour' AS "gap_start",
+            hour - INTERVAL '1 hour' AS "gap_end"
+        FROM (
+            SELECT exchange, source, sink, hour,
+                LAG(hour) OVER (
+                    PARTITION BY exchange, source, sink
+                    ORDER BY hour) AS prev_hour
+            FROM {0}
+            WHERE hour >= %(since)s) AS hours
+        WHERE hour - prev_hour > INTERVAL '1 hour'
+        ORDER BY exchange, source, sink, gap_start""".format(table),
+        {"since": since})
+    gaps = {}
+    for row in cursor.fetchall():
+        gaps.setdefault(
+            _pairKey(row["exchange"], row["source"], row["sink"]), []).append(
+            (row["gap_start"], row["gap_end"]))
+    return gaps
+
+
+def chooseTime(hoursNeeded):
+    """Return the smallest time window covering hoursNeeded hours."""
+    for name, hours in timeWindows:
+        if hours >= hoursNeeded:
+            return name
+    return allTime
+
+
+def windowHours(time):
+    """Return the number of hours a time window covers, None for alltime."""
+    return dict(timeWindows).get(time)
+
+
+def planPair(exchangePair, lastHour, gaps, now):
+    """Plan the fetch for one pair.
+
+    Returns a dictionary with the pair, the chosen hourly time window
+    (None when the pair is current), the daily time window (None unless
+    history older than hourlyHistoryTime is needed) and the reason for the
+    choice.
+    """
+    entry = {
+        "exchange": exchangePair["exchange"],
+        "source": exchangePair["source"],
+        "sink": exchangePair["sink"],
+        "last_hour": lastHour,
+        "gaps": gaps,
+        "daily": None,
+        "btc_volume": exchangePair.get("btc_volume")
+    }
+    currentHour = now.replace(minute=0, second=0, microsecond=0)
+    if lastHour is None:
+        _setTime(entry, allTime)
+        entry["reason"] = "new"
+        return entry
+
+    # Refetch from the last stored hour, which may have been partial, or
+    # from the first recent hole, whichever is older
+    earliest = lastHour
+    if gaps:
+        earliest = min(earliest, min(start for start, _ in gaps))
+    if earliest >= currentHour:
+        entry["time"] = None
+        entry["reason"] = "current"
+        return entry
+    hoursNeeded = int(
+        (currentHour - earliest).total_seconds() // 3600) + 1
+    _setTime(entry, chooseTime(hoursNeeded))
+    entry["reason"] = "gap" if gaps else "incremental"
+    return entry
+
+
+def _setTime(entry, time):
+    """Private method setting the time windows of a plan entry.
+
+    Requests for alltime are split into an hourly request covering
+    hourlyHistoryTime and a daily request for the full history.
+    """
+    if time == allTime and hourlyHistoryTime is not None:
+        entry["time"] = hourlyHistoryTime
+        entry["daily"] = allTime
+    else:
+        entry["time"] = time
+
+
+def fetchParams(entry):
+    """Return the requestPriceVolume arguments for a plan entry."""
+    params = []
+    if entry["time"] is not None:
+        params.append((entry["source"], entry["sink"], entry["exchange"],
+                       entry["time"], hourlyResolution))
+    if entry["daily"] is not None:
+        params.append((entry["source"], entry["sink"], entry["exchange"],
+                       entry["daily"], dailyResolution))
+    return params
+
+
+def plan(exchangePairs, highWaterMarks, gaps, now=None):
+    """Build a fetch plan for a list of exchange pairs."""
+    if now is None:
+        now = datetime.datetime.utcnow()
+    since = now - datetime.timedelta(hours=gapLookbackHours)
+    fetchPlan = []
+    for exchangePair in exchangePairs:
+        key = _pairKey(exchangePair["exchange"], exchangePair["source"],
+                       exchangePair["sink"])
+        pairGaps = [(start, end) for start, end in gaps.get(key, [])
+                    if end >= since]
+        fetchPlan.append(planPair(
+            exchangePair, highWaterMarks.get(key), pairGaps, now))
+    return fetchPlan
+
+
+def estimateSavings(fetchPlan):
+    """Estimate requests, rows and bytes saved against the baseline."""
+    baselineHours = windowHours(baselineTime)
+    requestsSaved = 0
+    rowsSaved = 0
+    for entry in fetchPlan:
+        # History fetches are not part of the baseline
+        if entry["reason"] == "new" or entry.get("daily") is not None:
+            continue
+        if entry["time"] is None:
+            requestsSaved += 1
+            rowsSaved += baselineHours
+        elif entry["time"] != allTime:
+            rowsSaved += baselineHours - windowHours(entry["time"])
+    return {
+        "requests_saved": requestsSaved,
+        "rows_saved": rowsSaved,
+        "bytes_saved": rowsSaved * bytesPerRow
+    }
+
+
+def logPlan(fetchPlan):
+    """Log a summary of a fetch plan and its estimated savings."""
+    reasons = {}
+    dailyCount = 0
+    for entry in fetchPlan:
+        reasons[entry["reason"]] = reasons.get(entry["reason"], 0) + 1
+        if entry.get("daily") is not None:
+            dailyCount += 1
+        if entry["reason"] == "gap":
+            logging.info("Pair {0}-{1}-{2} has {3} gap(s), \
+                fetching {4}.".format(
+                entry["exchange"], entry["source"], entry["sink"],
+                len(entry["gaps"]), entry["time"]))
+    savings = estimateSavings(fetchPlan)
+    logging.info("Fetch plan: {0}; {1} daily history fetches. \
+        Estimated savings: {2} requests, {3} rows, {4} bytes.".format(
+        ", ".join("{0} {1}".format(count, reason)
+                  for reason, count in sorted(reasons.items())),
+        dailyCount, savings["requests_saved"], savings["rows_saved"],
+        savings["bytes_saved"]))
+    return savings
+
+
+class PlannerTest(unittest.TestCase):
+
+    """Testing suite for planner module."""
+
+    def setUp(self):
+        """Set up a fixed clock and pair."""
+        self.now = datetime.datetime(2014, 7, 22, 17, 40)
+        self.pair = {"exchange": "btc-e", "source": "usd", "sink": "btc"}
+        self.key = ("btc-e", "usd", "btc")
+
+    def testChooseTime(self):
+        """Test chooseTime function."""
+        self.assertEqual(chooseTime(2), "24h")
+        self.assertEqual(chooseTime(24), "24h")
+        self.assertEqual(chooseTime(25), "3d")
+        self.assertEqual(chooseTime(10000), "alltime")
+
+    def testPlan(self):
+        """Test plan function."""
+        hour = datetime.datetime(2014, 7, 22, 17)
+        entries = plan([self.pair], {}, {}, self.now)
+        self.assertEqual(entries[0]["time"], "30d")
+        self.assertEqual(entries[0]["daily"], "alltime")
+        self.assertEqual(entries[0]["reason"], "new")
+        entries = plan([self.pair], {self.key: hour}, {}, self.now)
+        self.assertEqual(entries[0]["time"], None)
+        self.assertEqual(entries[0]["reason"], "current")
+        entries = plan([self.pair], {self.key: hour - datetime.timedelta(
+            hours=3)}, {}, self.now)
+        self.assertEqual(entries[0]["time"], "24h")
+        self.assertEqual(entries[0]["daily"], None)
+        self.assertEqual(entries[0]["reason"], "incremental")
+        gaps = {self.key: [
+            (hour - datetime.timedelta(days=5), hour - datetime.timedelta(
+                days=4)),
+            (hour - datetime.timedelta(days=50), hour - datetime.timedelta(
+                days=49))]}
+        entries = plan([self.pair], {self.key: hour}, gaps, self.now)
+        self.assertEqual(entries[0]["time"], "7d")
+        self.assertEqual(entries[0]["reason"], "gap")
+        self.assertEqual(len(entries[0]["gaps"]), 1)
+
+    def testFetchParams(self):
+        """Test fetchParams splits history into hourly and daily requests."""
+        entry = plan([self.pair], {}, {}, self.now)[0]
+        self.assertEqual(fetchParams(entry), [
+            ("usd", "btc", "btc-e", "30d", "1h"),
+            ("usd", "btc", "btc-e", "alltime", "1d")])
+        entry = plan([self.pair], {self.key: datetime.datetime(
+            2014, 7, 22, 17)}, {}, self.now)[0]
+        self.assertEqual(fetchParams(entry), [])
+        global hourlyHistoryTime
+        original = hourlyHistoryTime
+        hourlyHistoryTime = None
+        try:
+            entry = plan([self.pair], {}, {}, self.now)[0]
+        finally:
+            hourlyHistoryTime = original
+        self.assertEqual(fetchParams(entry), [
+            ("usd", "btc", "btc-e", "alltime", "1h")])
+
+    def testEstimateSavings(self):
+        """Test estimateSavings function."""
+        fetchPlan = [
+            {"reason": "current", "time": None, "gaps": []},
+            {"reason": "incremental", "time": "24h", "gaps": []},
+            {"reason": "new", "time": "alltime", "gaps": []}
+        ]
+        self.assertEqual(estimateSavings(fetchPlan), {
+            "requests_saved": 1,
+            "rows_saved": 240 + 216,
+            "bytes_saved": (240 + 216) * bytesPerRow
+        })
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+"""Plan a scrape and push its price / volume requests onto the work queue."""
+import cryptocoincharts
+import datetime
+import logging
+import pg
+import planner
+import scheduler
+import workqueue
+
+# Set logging level
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s:%(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p')
+
+# Compile a list of every exchange and currency pair
+logging.info("Starting scrape of exchanges.")
+exchanges = cryptocoincharts.parseExchanges(
+    cryptocoincharts.requestExchanges())
+exchangePairs = []
+for args, exchangeHtml, error in cryptocoincharts.requestBatch(
+        cryptocoincharts.requestExchange,
+        [(exchange["short_name"],) for exchange in exchanges]):
+    if error is not None:
+        logging.warning("Skipping exchange {0}: {1}".format(args[0], error))
+        continue
+    for pair in cryptocoincharts.parseExchange(exchangeHtml)[1]:
+        exchangePairs.append({
+            "source": pair["source"],
+            "sink": pair["sink"],
+            "exchange": args[0],
+            "btc_volume": pair.get("btc_volume")
+        })
+logging.info("Finished scrape of {0} exchanges.".format(len(exchanges)))
+
+# Enqueue the requests the plan calls for
+with pg.transaction() as cursor:
+    fetchPlan = planner.plan(
+        exchangePairs,
+        planner.readHighWaterMarks(cursor),
+        planner.readGaps(
+            cursor, datetime.datetime.utcnow() - datetime.timedelta(
+                hours=planner.gapLookbackHours)))
+planner.logPlan(fetchPlan)
+
+# Workers claim jobs in the order they were last enqueued, so due jobs are
+# enqueued by priority; pairs that are not due yet are left for a later
+# coordinator run
+dueEntries, deferredEntries = scheduler.schedule(fetchPlan)
+logging.info("Scheduled {0} due pairs, deferred {1}.".format(
+    len(dueEntries), len(deferredEntries)))
+workQueue = workqueue.WorkQueue()
+count = workQueue.enqueue(
+    [params for entry in dueEntries
+     for params in planner.fetchParams(entry)])
+logging.info("Enqueued {0} jobs; queue now holds {1}.".format(
+    count, workQueue.counts()))
+workQueue.close()
@@ -0,0 +1,50 @@
+"""Claim and process jobs from the work queue; run one per host or IP."""
+import archive
+import cryptocoincharts
+import logging
+import metrics
+import os
+import socket
+import sys
+import workqueue
+
+# Compressed, deduplicated store for every raw response. An archive is
+# written by one process only, so workers sharing a host need their own
+# directories, given with --archive; a worker refuses to start on an
+# archive another worker holds.
+archiveDir = "{0}/data/archive_{1}".format(
+    os.path.dirname(os.path.abspath(__file__)), socket.gethostname())
+if "--archive" in sys.argv:
+    archiveDir = sys.argv[sys.argv.index("--archive") + 1]
+
+# Per-worker metrics written when the worker exits
+metricsPrometheusFile = "{0}/data/metrics_worker_{1}.prom".format(
+    os.path.dirname(os.path.abspath(__file__)), os.getpid())
+
+# Set logging level
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s:%(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p')
+
+archiveLock = archive.lockWriter(archiveDir)
+if archiveLock is None:
+    logging.error("Archive {0} is in use by another worker; \
+        pass --archive with a directory of its own.".format(archiveDir))
+    sys.exit(1)
+
+# Pass --once to exit when the queue is empty instead of polling
+responseArchive = archive.Archive(archiveDir)
+workQueue = workqueue.WorkQueue()
+try:
+    completed = workqueue.runWorker(
+        workQueue, responseArchive, exitWhenIdle="--once" in sys.argv)
+    logging.info("Worker {0} completed {1} jobs. \
+        Issued {2} requests, {3} not modified.".format(
+        workQueue.worker, completed, cryptocoincharts.countRequested,
+        cryptocoincharts.countNotModified))
+finally:
+    workQueue.close()
+    responseArchive.close()
+    archiveLock.close()
+    metrics.writePrometheus(metricsPrometheusFile)
@@ -0,0 +1,16 @@
+"""Recompute the daily and weekly rollup tables from exchange_pair_hour."""
+import logging
+import pg
+import sys
+
+# Set logging level
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s:%(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p')
+
+# Pass units, e.g. "week", to rebuild only those rollups
+units = sys.argv[1:] or None
+logging.info("Starting rebuild of rollups from {0}.".format(pg.targetTable))
+pg.rebuildRollups(units)
+logging.info("Finished rebuild of rollups.")
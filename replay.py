@@ -0,0 +1,157 @@
+"""Offline rebuild of price / volume data from archived responses."""
+import archive
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+pricePrefix = "price_volume_"
+
+
+def parsePrefix(prefix):
+    """Split a price / volume archive prefix into request parameters.
+
+    Returns (source, sink, exchange, time, resolution), or None if the
+    prefix does not belong to a price / volume response.
+    """
+    if not prefix.startswith(pricePrefix):
+        return None
+    parts = prefix[len(pricePrefix):].split("_")
+    if len(parts) < 5:
+        return None
+    return (parts[0], parts[1], "_".join(parts[2:-2]), parts[-2], parts[-1])
+
+
+def _newest(fetches):
+    """Private method keeping the newest fetch per prefix.
+
+    Takes (prefix, fetched_at, locator) tuples and returns them sorted by
+    fetch time, so later dumps overwrite earlier ones when loaded in order.
+    """
+    newest = {}
+    for prefix, fetchedAt, locator in fetches:
+        if prefix not in newest or newest[prefix][1] < fetchedAt:
+            newest[prefix] = (prefix, fetchedAt, locator)
+    return sorted(newest.values(), key=lambda fetch: (fetch[1], fetch[0]))
+
+
+def archiveJobs(archivePath):
+    """List parse jobs for the newest archived dump of every request."""
+    responseArchive = archive.Archive(archivePath)
+    fetches = responseArchive.find(pricePrefix + "%")
+    responseArchive.close()
+    jobs = []
+    for prefix, _, digest in _newest(
+            (prefix, fetchedAt, digest)
+            for prefix, _, fetchedAt, digest in fetches):
+        params = parsePrefix(prefix)
+        if params is not None:
+            jobs.append((archivePath, digest) + params[:3])
+    return jobs
+
+
+def legacyJobs(dataDir):
+    """List parse jobs for the newest writeToFile dump of every request."""
+    fetches = []
+    for fileName in os.listdir(dataDir):
+        match = archive.legacyName.match(fileName)
+        if match is not None and match.group("ext") == "json":
+            fetches.append((
+                match.group("prefix"), int(match.group("time")),
+                os.path.join(dataDir, fileName)))
+    jobs = []
+    for prefix, _, path in _newest(fetches):
+        params = parsePrefix(prefix)
+        if params is not None:
+            jobs.append((path,) + params[:3])
+    return jobs
+
+
+def _replay(jobs, imapName, load, processes):
+    """Private method parsing jobs in parallel and loading them in order."""
+    import parsepool
+    if load is None:
+        import pg
+        load = pg.loadPriceVolume
+    start = time.time()
+    dumps = 0
+    rows = 0
+    with parsepool.ParsePool(processes) as pool:
+        for priceVolume in getattr(pool, imapName)(jobs, ordered=True):
+            load(priceVolume)
+            dumps += 1
+            rows += len(priceVolume)
+    seconds = time.time() - start
+    result = {
+        "dumps": dumps,
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_sec": rows / seconds if seconds > 0 else None
+    }
+    logging.info("Replayed {dumps} dumps with {rows} rows in \
+        {seconds:.1f} seconds ({rows_per_sec:.0f} rows/sec).".format(
+        **result))
+    return result
+
+
+def replayArchive(archivePath, processes=None, load=None):
+    """Reload the newest archived dump of every request without the network.
+
+    Parsing runs on a process pool; load defaults to pg.loadPriceVolume.
+    """
+    return _replay(archiveJobs(archivePath), "imapPriceVolumeArchived",
+                   load, processes)
+
+
+def replayLegacy(dataDir, processes=None, load=None):
+    """Reload the newest writeToFile dump of every request."""
+    return _replay(legacyJobs(dataDir), "imapPriceVolumeFiles",
+                   load, processes)
+
+
+class ReplayTest(unittest.TestCase):
+
+    """Testing suite for replay module."""
+
+    def setUp(self):
+        """Create a scratch archive with example dumps."""
+        self.path = tempfile.mkdtemp()
+        f = open("{0}/example/price_volume_usd_btc_btc-e_alltime_1h.json"
+                 .format(os.path.dirname(os.path.abspath(__file__))), 'r')
+        self.jsonDump = f.read()
+        f.close()
+
+    def tearDown(self):
+        """Remove the scratch archive."""
+        shutil.rmtree(self.path)
+
+    def testParsePrefix(self):
+        """Test parsePrefix function."""
+        self.assertEqual(
+            parsePrefix("price_volume_usd_btc_btc-e_alltime_1h"),
+            ("usd", "btc", "btc-e", "alltime", "1h"))
+        self.assertEqual(parsePrefix("exchange_btc-e"), None)
+
+    def testReplayArchive(self):
+        """Test replayArchive loads the newest dump per request."""
+        archivePath = os.path.join(self.path, "archive")
+        responseArchive = archive.Archive(archivePath)
+        responseArchive.put(
+            u"[]", "price_volume_usd_btc_btc-e_alltime_1h", "json", 10)
+        responseArchive.put(
+            self.jsonDump, "price_volume_usd_btc_btc-e_alltime_1h", "json",
+            20)
+        responseArchive.put(
+            u'[["2014-07-22 17",1,2,3,4,5,6,7,8,null]]',
+            "price_volume_usd_btc_btc-e_10d_1h", "json", 30)
+        responseArchive.put(u"<html>", "exchanges", "html", 40)
+        responseArchive.close()
+        loaded = []
+        result = replayArchive(archivePath, 1, loaded.append)
+        self.assertEqual([len(frame) for frame in loaded], [9229, 1])
+        self.assertEqual(result["rows"], 9230)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+"""Rebuild exchange_pair_hour from archived responses without the network."""
+import logging
+import os
+import replay
+import sys
+
+dataDir = "{0}/data".format(os.path.dirname(os.path.abspath(__file__)))
+archiveDir = "{0}/archive".format(dataDir)
+
+# Worker processes for parsing; None uses one per core
+processes = None
+
+# Set logging level
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s:%(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p')
+
+# Pass --legacy to replay files written by writeToFile instead
+if "--legacy" in sys.argv:
+    logging.info("Starting replay of {0}.".format(dataDir))
+    replay.replayLegacy(dataDir, processes)
+else:
+    logging.info("Starting replay of {0}.".format(archiveDir))
+    replay.replayArchive(archiveDir, processes)
+logging.info("Finished replay.")
@@ -0,0 +1,211 @@
+"""Volume-priority ordering of planned fetches under a per-run budget.
+
+Every pair gets a refresh interval between minRefreshHours, for the most
+traded pair, and maxRefreshHours, for pairs without volume, interpolated
+geometrically by volume rank. A pair is due once its data is at least one
+interval old, counting from its oldest recent hole, and new pairs are always
+due. Due pairs are fetched most overdue first, so a run cut short by its
+budget leaves only the least valuable pairs stale.
+"""
+import bisect
+import datetime
+import logging
+import metrics
+import planner
+import threading
+import time
+import unittest
+
+# Refresh intervals of the highest and lowest volume pairs
+minRefreshHours = 1
+maxRefreshHours = 168
+
+
+def refreshHours(volume, sortedVolumes):
+    """Return the refresh interval of a pair given every pair's volume."""
+    if len(sortedVolumes) < 2:
+        return minRefreshHours
+    rank = float(bisect.bisect_left(sortedVolumes, volume)) / (
+        len(sortedVolumes) - 1)
+    return maxRefreshHours * (
+        float(minRefreshHours) / maxRefreshHours) ** min(rank, 1.0)
+
+
+def _staleHours(entry, currentHour):
+    """Private method returning how many hours a pair's data lags.
+
+    New pairs count as maxRefreshHours stale, and recent holes count from
+    their start.
+    """
+    if entry["last_hour"] is None:
+        return maxRefreshHours
+    earliest = entry["last_hour"]
+    if entry["gaps"]:
+        earliest = min(earliest, min(start for start, _ in entry["gaps"]))
+    return max(0.0, (currentHour - earliest).total_seconds() / 3600)
+
+
+def schedule(fetchPlan, now=None):
+    """Split plan entries into due entries, by priority, and deferred ones.
+
+    Entries with nothing to fetch are in neither list. Each scheduled
+    entry gains its volume, refresh_hours, stale_hours and priority, the
+    number of refresh intervals it is overdue by.
+    """
+    if now is None:
+        now = datetime.datetime.utcnow()
+    currentHour = now.replace(minute=0, second=0, microsecond=0)
+    entries = [entry for entry in fetchPlan if planner.fetchParams(entry)]
+    sortedVolumes = sorted(entry.get("btc_volume") or 0.0
+                           for entry in entries)
+    due = []
+    deferred = []
+    for entry in entries:
+        entry["volume"] = entry.get("btc_volume") or 0.0
+        entry["refresh_hours"] = refreshHours(entry["volume"], sortedVolumes)
+        entry["stale_hours"] = _staleHours(entry, currentHour)
+        entry["priority"] = entry["stale_hours"] / entry["refresh_hours"]
+        if entry["priority"] >= 1 or entry["reason"] == "new":
+            due.append(entry)
+        else:
+            deferred.append(entry)
+    due.sort(key=lambda entry: (-entry["priority"], -entry["volume"]))
+    return due, deferred
+
+
+class Budget(object):
+
+    """Wall-clock and request allowance for one run, shared by threads."""
+
+    def __init__(self, seconds=None, requests=None):
+        """Start the clock."""
+        self.seconds = seconds
+        self.requests = requests
+        self.start = time.time()
+        self.used = 0
+        self.refused = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Return whether one more request fits, and count it if so."""
+        with self.lock:
+            if (self.seconds is not None and
+                    time.time() - self.start >= self.seconds) or (
+                    self.requests is not None and
+                    self.used >= self.requests):
+                self.refused += 1
+                return False
+            self.used += 1
+            return True
+
+
+def coverage(fetchPlan, due, deferred, isRefreshed):
+    """Summarize how much of the traded volume a run left fresh.
+
+    isRefreshed is called with a due entry and returns whether all of its
+    requests were loaded. Pairs with nothing to fetch count as fresh.
+    """
+    scheduled = set(id(entry) for entry in due + deferred)
+    current = [entry for entry in fetchPlan if id(entry) not in scheduled]
+    refreshed = [entry for entry in due if isRefreshed(entry)]
+    stale = [entry for entry in due if not isRefreshed(entry)]
+
+    def volume(entries):
+        return sum(entry.get("btc_volume") or 0.0 for entry in entries)
+    totalVolume = volume(fetchPlan)
+    freshVolume = volume(current) + volume(refreshed) + volume(deferred)
+    return {
+        "pairs": len(fetchPlan),
+        "current": len(current),
+        "refreshed": len(refreshed),
+        "deferred": len(deferred),
+        "stale": len(stale),
+        "volume_coverage": freshVolume / totalVolume if totalVolume else None,
+        "stale_volume": volume(stale)
+    }
+
+
+def logCoverage(report):
+    """Log a coverage report and record it in the metrics."""
+    for status in ("current", "refreshed", "deferred", "stale"):
+        metrics.count("schedule_pairs", report[status], status=status)
+    logging.info("Coverage: {0} pairs, {1} current, {2} refreshed, \
+        {3} deferred until due, {4} left stale by the budget. \
+        Volume coverage {5}, stale volume {6:.2f} BTC.".format(
+        report["pairs"], report["current"], report["refreshed"],
+        report["deferred"], report["stale"],
+        "{0:.1%}".format(report["volume_coverage"])
+        if report["volume_coverage"] is not None else "n/a",
+        report["stale_volume"]))
+
+
+class SchedulerTest(unittest.TestCase):
+
+    """Testing suite for scheduler module."""
+
+    def setUp(self):
+        """Set up a fixed clock and pairs of different volumes."""
+        self.now = datetime.datetime(2014, 7, 22, 17, 40)
+        hour = datetime.datetime(2014, 7, 22, 17)
+        self.pairs = [
+            {"exchange": "btc-e", "source": "usd", "sink": "btc",
+             "btc_volume": 5000.0},
+            {"exchange": "btc-e", "source": "btc", "sink": "ltc",
+             "btc_volume": 300.0},
+            {"exchange": "btc-e", "source": "btc", "sink": "nmc",
+             "btc_volume": 2.0},
+            {"exchange": "btc-e", "source": "btc", "sink": "ppc"},
+            {"exchange": "btc-e", "source": "btc", "sink": "xpm",
+             "btc_volume": 0.5},
+            {"exchange": "btc-e", "source": "btc", "sink": "doge",
+             "btc_volume": 0.1}]
+        self.highWaterMarks = {
+            ("btc-e", "usd", "btc"): hour - datetime.timedelta(hours=3),
+            ("btc-e", "btc", "ltc"): hour - datetime.timedelta(hours=5),
+            ("btc-e", "btc", "nmc"): hour - datetime.timedelta(hours=3),
+            ("btc-e", "btc", "ppc"): hour - datetime.timedelta(days=8),
+            ("btc-e", "btc", "doge"): hour - datetime.timedelta(hours=1)}
+        # An hour without trades two days ago, as the site leaves them
+        self.gaps = {
+            ("btc-e", "btc", "doge"): [(hour - datetime.timedelta(days=2),
+                                        hour - datetime.timedelta(days=2))]}
+
+    def testRefreshHours(self):
+        """Test intervals shrink geometrically with volume rank."""
+        volumes = [0.0, 1.0, 10.0]
+        self.assertEqual(refreshHours(0.0, volumes), maxRefreshHours)
+        self.assertEqual(refreshHours(10.0, volumes), minRefreshHours)
+        self.assertAlmostEqual(
+            refreshHours(1.0, volumes),
+            (minRefreshHours * maxRefreshHours) ** 0.5)
+        self.assertEqual(refreshHours(5.0, [5.0]), minRefreshHours)
+
+    def testSchedule(self):
+        """Test due pairs are ordered by priority and others deferred."""
+        fetchPlan = planner.plan(
+            self.pairs, self.highWaterMarks, self.gaps, self.now)
+        due, deferred = schedule(fetchPlan, self.now)
+        self.assertEqual([entry["sink"] for entry in due],
+                         ["xpm", "btc", "ltc", "ppc"])
+        self.assertEqual([entry["sink"] for entry in deferred],
+                         ["nmc", "doge"])
+        # A hole in a thin pair waits for the pair's own interval
+        self.assertEqual(deferred[1]["reason"], "gap")
+        self.assertTrue(deferred[1]["priority"] < 1)
+
+        budget = Budget(requests=2)
+        self.assertEqual([budget.allow() for _ in range(3)],
+                         [True, True, False])
+        self.assertFalse(Budget(seconds=0).allow())
+
+        report = coverage(fetchPlan, due, deferred,
+                          lambda entry: entry["sink"] in ("xpm", "btc"))
+        self.assertEqual(report["refreshed"], 2)
+        self.assertEqual(report["stale"], 2)
+        self.assertEqual(report["deferred"], 2)
+        self.assertEqual(report["stale_volume"], 300.0)
+        self.assertAlmostEqual(
+            report["volume_coverage"], 5002.6 / 5302.6)
+
+if __name__ == "__main__":
+    unittest.main()
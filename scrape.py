@@ -1,120 +1,262 @@
 """Core scraper for prive volume data from cryptocoincharts.info."""
-import codecs
+import archive
 import cryptocoincharts
+import datetime
+import exchangecache
+import journal
 import logging
+import metrics
 import os
 import pg
+import pipeline
+import planner
+import scheduler
 import sys
-import time
-import traceback
-
-
-# Helper for file writing
-def writeToFile(content, prefix, extension):
-    """Write data to file."""
-    f = codecs.open("{0}/data/{1}_{2}.{3}".format(
-        os.path.dirname(os.path.abspath(__file__)),
-        prefix, int(time.time()), extension), 'w', 'utf-8')
-    f.write(content)
-    f.close()
-
-# Establish database connection
-cursor = pg.dictCursor()
-
-# Set logging level
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s:%(message)s',
-    datefmt='%m/%d/%Y %I:%M:%S %p')
-
-# Pull in the list of exchanges
-logging.info("Starting scrape of exchange list.")
-exchangesHtml = cryptocoincharts.requestExchanges()
-writeToFile(exchangesHtml, "exchanges", "html")
-exchanges = cryptocoincharts.parseExchanges(exchangesHtml)
-logging.info("Finished scrape of exchange list.")
-
-# Compile a list of every required exchange and currency pair
-logging.info("Starting scrape of individual exchanges.")
-exchangePairs = []
-for exchange in exchanges:
-    logging.info("Starting scrape of exchange {0}.".format(
-        exchange["short_name"]))
-    exchangeHtml = cryptocoincharts.requestExchange(exchange["short_name"])
-    writeToFile(
-        exchangeHtml,
-        "exchange_{0}".format(exchange["short_name"]),
-        "html"
-    )
-    exchangeSummary, pairs = cryptocoincharts.parseExchange(exchangeHtml)
-    for pair in pairs:
-            exchangePairs.append({
-                "source": pair["source"],
-                "sink": pair["sink"],
-                "exchange": exchange["short_name"]
-            })
-    logging.info("Finished scrape of exchange {0}.".format(
-        exchange["short_name"]))
-logging.info("Finished scrape of indivdual exchanges.")
-
-# exchangePairs = [
-#     {'source': 'usd', 'sink': 'btc', 'exchange': 'btc-e'},
-#     {'source': 'usd', 'sink': 'ltc', 'exchange': 'btc-e'}
-# ]
-
-# Download information for every exchange and currency pair
-logging.info("Starting scrape of price volume information")
-priceVolumes = []
-cursor.execute("""SELECT
-        CONCAT(exchange, '-', source, '-', sink) AS "exchange_pair",
-        MAX(hour) AS "last_hour"
-    FROM exchange_pair_hour
-    GROUP BY exchange, source, sink
-    ORDER BY exchange, source, sink""")
-rows = cursor.fetchall()
-priceVolumesLatest = dict(
-    [(row["exchange_pair"], row["last_hour"]) for row in rows]
-)
-for exchangePair in exchangePairs:
-    # Find out whether we want data over all time or only the last several days
-    exchangePairCompact = "{0}-{1}-{2}".format(
-        exchangePair["exchange"],
-        exchangePair["source"],
-        exchangePair["sink"])
-    if exchangePairCompact in priceVolumesLatest:
-        logging.info("Previous data exists. \
-            Starting scrape for 10 days of price volume info for {0}".format(
-            exchangePairCompact))
-        pvTime = "10d"
-    else:
-        logging.info("No previous data exists. \
-            Starting scrape for all price volume info for {0}".format(
-            exchangePairCompact))
-        pvTime = "alltime"
-    # Scrape the actual data
-    priceVolumeParams = [
-        exchangePair["source"], exchangePair["sink"],
-        exchangePair["exchange"], pvTime, "1h"
-    ]
-    try:
-        priceVolumeJsonDump = cryptocoincharts.requestPriceVolume(
+
+# Compressed, deduplicated store for every raw response
+archiveDir = "{0}/data/archive".format(
+    os.path.dirname(os.path.abspath(__file__)))
+
+# Worker threads per pipeline stage and bound of each stage's input queue.
+# Every load worker holds one of pg's pooled connections while it loads.
+fetchWorkers = cryptocoincharts.maxInFlight
+archiveWorkers = 1
+parseWorkers = 1
+loadWorkers = pg.poolSize
+queueSize = 16
+
+# Per-run budget of seconds and of price / volume requests; None leaves it
+# unlimited. Pairs are fetched by volume priority, so a run cut short
+# leaves the least traded pairs stale.
+budgetSeconds = None
+budgetRequests = None
+
+# Worker processes for parsing; 0 parses on the parse stage's threads
+parseProcesses = 0
+
+# Cache of HTTP validators used for conditional requests across runs
+validatorsFile = "{0}/data/http_validators.json".format(
+    os.path.dirname(os.path.abspath(__file__)))
+
+# Per-stage metrics written at the end of each run
+metricsPrometheusFile = "{0}/data/metrics.prom".format(
+    os.path.dirname(os.path.abspath(__file__)))
+metricsJsonFile = "{0}/data/metrics.json".format(
+    os.path.dirname(os.path.abspath(__file__)))
+
+# Checkpoint journal; an interrupted run resumes from it on the next start
+journalFile = "{0}/data/journal.jsonl".format(
+    os.path.dirname(os.path.abspath(__file__)))
+
+# Pair lists of fully loaded exchanges, keyed by their last_update
+exchangeCacheFile = "{0}/data/exchange_cache.json".format(
+    os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(runSeconds=None, runRequests=None):
+    """Scrape the exchanges, then fetch, parse and load price / volume data.
+
+    runSeconds and runRequests override budgetSeconds and budgetRequests.
+    """
+    # Set logging level
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s:%(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S %p')
+
+    # Compressed, deduplicated store for every raw response
+    responseArchive = archive.Archive(archiveDir)
+
+    # Reuse validators from previous runs; price / volume bodies behind
+    # them are read back from the archive
+    cryptocoincharts.loadValidators(validatorsFile)
+    cryptocoincharts.bodyArchive = responseArchive
+
+    # Resume an interrupted run or start a new one
+    runJournal = journal.Journal(journalFile)
+    if runJournal.begin():
+        logging.info("Resuming interrupted run with {0} pairs loaded.".format(
+            len(runJournal.loaded)))
+
+    # Pull in the list of exchanges
+    exchanges = runJournal.exchanges()
+    if exchanges is None:
+        logging.info("Starting scrape of exchange list.")
+        exchangesHtml = cryptocoincharts.requestExchanges()
+        responseArchive.put(exchangesHtml, "exchanges", "html")
+        exchanges = cryptocoincharts.parseExchanges(exchangesHtml)
+        runJournal.recordExchanges(exchanges)
+        logging.info("Finished scrape of exchange list.")
+
+    # Compile a list of every required exchange and currency pair
+    logging.info("Starting scrape of individual exchanges.")
+    exchangeCache = exchangecache.ExchangeCache(exchangeCacheFile)
+    exchangePairs = []
+    scrapedExchanges = []
+    for exchange in exchanges:
+        # Exchanges that have not updated since they were loaded are skipped
+        if exchangeCache.isUnchanged(exchange):
+            logging.info("Skipping unchanged exchange {0}.".format(
+                exchange["short_name"]))
+            metrics.count("exchanges_skipped")
+            continue
+        pairs = runJournal.pairs(exchange["short_name"])
+        if pairs is None:
+            logging.info("Starting scrape of exchange {0}.".format(
+                exchange["short_name"]))
+            exchangeHtml = cryptocoincharts.requestExchange(
+                exchange["short_name"])
+            responseArchive.put(
+                exchangeHtml,
+                "exchange_{0}".format(exchange["short_name"]),
+                "html"
+            )
+            exchangeSummary, pairs = cryptocoincharts.parseExchange(
+                exchangeHtml)
+            runJournal.recordPairs(exchange["short_name"], pairs)
+        scrapedExchanges.append((exchange, pairs))
+        for pair in pairs:
+                exchangePairs.append({
+                    "source": pair["source"],
+                    "sink": pair["sink"],
+                    "exchange": exchange["short_name"],
+                    "btc_volume": pair.get("btc_volume")
+                })
+        logging.info("Finished scrape of exchange {0}.".format(
+            exchange["short_name"]))
+    logging.info("Finished scrape of indivdual exchanges.")
+
+    # exchangePairs = [
+    #     {'source': 'usd', 'sink': 'btc', 'exchange': 'btc-e'},
+    #     {'source': 'usd', 'sink': 'ltc', 'exchange': 'btc-e'}
+    # ]
+
+    # Download information for every exchange and currency pair
+    logging.info("Starting scrape of price volume information")
+    with pg.transaction() as cursor:
+        fetchPlan = planner.plan(
+            exchangePairs,
+            planner.readHighWaterMarks(cursor),
+            planner.readGaps(
+                cursor, datetime.datetime.utcnow() - datetime.timedelta(
+                    hours=planner.gapLookbackHours)))
+    planner.logPlan(fetchPlan)
+
+    # Fetch the most traded and most overdue pairs first; pairs refreshed
+    # recently enough for their volume wait for a later run
+    dueEntries, deferredEntries = scheduler.schedule(fetchPlan)
+    logging.info("Scheduled {0} due pairs, deferred {1}.".format(
+        len(dueEntries), len(deferredEntries)))
+    budget = scheduler.Budget(
+        runSeconds if runSeconds is not None else budgetSeconds,
+        runRequests if runRequests is not None else budgetRequests)
+    priceVolumeParamsList = []
+    for entry in dueEntries:
+        # Pairs that are already current need no request at all, and deep
+        # history is requested at daily resolution
+        for priceVolumeParams in planner.fetchParams(entry):
+            # Requests loaded before an interruption are not fetched again
+            if not runJournal.isLoaded(
+                    priceVolumeParams[2], priceVolumeParams[0],
+                    priceVolumeParams[1], priceVolumeParams[4]):
+                priceVolumeParamsList.append(priceVolumeParams)
+
+    # Pipeline stages for price volume data
+    def fetchStage(priceVolumeParams):
+        """Request price volume data for one pair within the budget."""
+        if not budget.allow():
+            return None
+        return priceVolumeParams, cryptocoincharts.requestPriceVolume(
             *priceVolumeParams)
-    except Exception as e:
-        priceVolumeStr = "-".join(priceVolumeParams)
-        print '-'*60
-        print "Could not request URL for price volume {0}:".format(
-            priceVolumeStr)
-        print traceback.format_exc()
-        print '-'*60
-        logging.info("Could not request URL for price volume {0}:".format(
-            priceVolumeStr))
-        continue
-    writeToFile(
-        priceVolumeJsonDump,
-        "price_volume_{0}".format("_".join(priceVolumeParams)),
-        "json"
-    )
-    priceVolume = cryptocoincharts.parsePriceVolume(
-        priceVolumeJsonDump, exchangePair["source"],
-        exchangePair["sink"], exchangePair["exchange"])
-    pg.loadPriceVolume(priceVolume)
+
+    def archiveStage(item):
+        """Write the raw price volume response to the archive."""
+        priceVolumeParams, priceVolumeJsonDump = item
+        responseArchive.put(
+            priceVolumeJsonDump,
+            "price_volume_{0}".format("_".join(priceVolumeParams)),
+            "json"
+        )
+        return item
+
+    def parseStage(item):
+        """Parse the raw price volume response."""
+        priceVolumeParams, priceVolumeJsonDump = item
+        if parsePool is not None:
+            return priceVolumeParams, parsePool.parsePriceVolume(
+                priceVolumeJsonDump, priceVolumeParams[0],
+                priceVolumeParams[1], priceVolumeParams[2])
+        return priceVolumeParams, cryptocoincharts.parsePriceVolume(
+            priceVolumeJsonDump, priceVolumeParams[0],
+            priceVolumeParams[1], priceVolumeParams[2])
+
+    def loadStage(item):
+        """Load parsed price volume data and checkpoint the pair."""
+        priceVolumeParams, priceVolume = item
+        changes = pg.loadPriceVolume(priceVolume)
+        if isinstance(changes, dict):
+            for (exchange, source, sink), counts in sorted(changes.items()):
+                logging.info("Loaded {0}-{1}-{2} {3}: {4} inserted, \
+                    {5} updated, {6} unchanged.".format(
+                    exchange, source, sink, priceVolumeParams[4],
+                    counts["inserted"], counts["updated"],
+                    counts["unchanged"]))
+        runJournal.recordLoaded(
+            priceVolumeParams[2], priceVolumeParams[0], priceVolumeParams[1],
+            priceVolumeParams[4])
+
+    # Fetch, archive, parse and load concurrently with bounded queues
+    parsePool = None
+    workers = parseWorkers
+    if parseProcesses > 0:
+        import parsepool
+        parsePool = parsepool.ParsePool(parseProcesses)
+        workers = parseProcesses
+    priceVolumePipeline = pipeline.Pipeline([
+        pipeline.Stage("fetch", fetchStage, fetchWorkers, queueSize),
+        pipeline.Stage("archive", archiveStage, archiveWorkers, queueSize),
+        pipeline.Stage("parse", parseStage, workers, queueSize),
+        pipeline.Stage("load", loadStage, loadWorkers, queueSize)
+    ])
+    pipeline.logStats(priceVolumePipeline.run(priceVolumeParamsList))
+    if parsePool is not None:
+        parsePool.close()
+
+    # Report how much of the traded volume is fresh
+    def isRefreshed(entry):
+        """Return whether every request of a due pair was loaded."""
+        return all(runJournal.isLoaded(
+            priceVolumeParams[2], priceVolumeParams[0], priceVolumeParams[1],
+            priceVolumeParams[4])
+            for priceVolumeParams in planner.fetchParams(entry))
+
+    if budget.refused:
+        logging.info("Budget skipped {0} requests.".format(budget.refused))
+    scheduler.logCoverage(scheduler.coverage(
+        fetchPlan, dueEntries, deferredEntries, isRefreshed))
+
+    # Cache exchanges whose planned pairs all loaded so later runs skip
+    # them; exchanges with deferred pairs are checked again
+    unloadedExchanges = set(
+        priceVolumeParams[2] for priceVolumeParams in priceVolumeParamsList
+        if not runJournal.isLoaded(
+            priceVolumeParams[2], priceVolumeParams[0], priceVolumeParams[1],
+            priceVolumeParams[4]))
+    unloadedExchanges.update(entry["exchange"] for entry in deferredEntries)
+    for exchange, pairs in scrapedExchanges:
+        if exchange["short_name"] not in unloadedExchanges:
+            exchangeCache.update(exchange, pairs)
+    exchangeCache.save()
+    cryptocoincharts.saveValidators(validatorsFile)
+    responseArchive.close()
+    pg.closePool()
+    runJournal.finish()
+    metrics.writePrometheus(metricsPrometheusFile)
+    metrics.writeJson(metricsJsonFile)
+    logging.info("Finished scrape of price volume information. \
+        Issued {0} requests, {1} not modified.".format(
+        cryptocoincharts.countRequested, cryptocoincharts.countNotModified))
+
+
+if __name__ == "__main__":
+    main()
@@ -13,7 +13,7 @@ CREATE TABLE IF NOT EXISTS exchange_pair_hour (
     field_7 DECIMAL,
     field_8 DECIMAL);
 
-CREATE INDEX ON exchange_pair_hour (exchange, source, sink, hour);
+CREATE UNIQUE INDEX ON exchange_pair_hour (exchange, source, sink, hour);
 CREATE INDEX ON exchange_pair_hour (source, sink, hour);
 CREATE INDEX ON exchange_pair_hour (sink, hour);
 CREATE INDEX ON exchange_pair_hour (exchange, hour);
\ No newline at end of file
@@ -0,0 +1,17 @@
+-- Daily bars fetched for history older than the hourly window. Loaded by
+-- pg.loadPriceVolume whenever the data is keyed by date.
+CREATE TABLE IF NOT EXISTS exchange_pair_day (
+    exchange VARCHAR(20),
+    source VARCHAR(10),
+    sink VARCHAR(10),
+    date DATE,
+    price_low DECIMAL,
+    price_25th_percentile DECIMAL,
+    price_75th_percentile DECIMAL,
+    price_high DECIMAL,
+    price_median DECIMAL,
+    price_ema20 DECIMAL,
+    volume DECIMAL,
+    field_7 DECIMAL,
+    field_8 DECIMAL,
+    PRIMARY KEY (exchange, source, sink, date));
@@ -0,0 +1,22 @@
+-- Partitioned variant of exchange_pair_hour (PostgreSQL 11+). Set
+-- pg.partitioned = True when using it; pg.loadPriceVolume creates a
+-- monthly partition, e.g. exchange_pair_hour_p201407, on first use.
+CREATE TABLE IF NOT EXISTS exchange_pair_hour (
+    exchange VARCHAR(20),
+    source VARCHAR(10),
+    sink VARCHAR(10),
+    hour TIMESTAMP,
+    price_low DECIMAL,
+    price_25th_percentile DECIMAL,
+    price_75th_percentile DECIMAL,
+    price_high DECIMAL,
+    price_median DECIMAL,
+    price_ema20 DECIMAL,
+    volume DECIMAL,
+    field_7 DECIMAL,
+    field_8 DECIMAL,
+    PRIMARY KEY (exchange, source, sink, hour))
+PARTITION BY RANGE (hour);
+
+CREATE INDEX IF NOT EXISTS exchange_pair_hour_hour_brin
+    ON exchange_pair_hour USING BRIN (hour);
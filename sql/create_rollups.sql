@@ -0,0 +1,24 @@
+-- Daily and weekly rollups of exchange_pair_hour, kept current by
+-- pg.loadPriceVolume. Fill them for existing data with
+-- "python rebuild_rollups.py".
+CREATE TABLE IF NOT EXISTS exchange_pair_day_rollup (
+    exchange VARCHAR(20),
+    source VARCHAR(10),
+    sink VARCHAR(10),
+    bucket TIMESTAMP,
+    price_open DECIMAL,
+    price_high DECIMAL,
+    price_low DECIMAL,
+    price_close DECIMAL,
+    volume DECIMAL,
+    field_7 DECIMAL,
+    hours INTEGER,
+    PRIMARY KEY (exchange, source, sink, bucket));
+
+CREATE TABLE IF NOT EXISTS exchange_pair_week_rollup (
+    LIKE exchange_pair_day_rollup INCLUDING ALL);
+
+CREATE INDEX IF NOT EXISTS exchange_pair_day_rollup_source_sink_bucket_idx
+    ON exchange_pair_day_rollup (source, sink, bucket);
+CREATE INDEX IF NOT EXISTS exchange_pair_week_rollup_source_sink_bucket_idx
+    ON exchange_pair_week_rollup (source, sink, bucket);
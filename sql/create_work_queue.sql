@@ -0,0 +1,26 @@
+-- Work queue for distributed scraping with queue_coordinator.py and
+-- queue_worker.py (PostgreSQL 9.6+ for SKIP LOCKED, ON CONFLICT and
+-- ADD COLUMN IF NOT EXISTS). Jobs are claimed in enqueued_seq order, which
+-- every enqueue renews, so each coordinator run's priorities take effect.
+CREATE TABLE IF NOT EXISTS scrape_queue (
+    id BIGSERIAL PRIMARY KEY,
+    exchange VARCHAR(20) NOT NULL,
+    source VARCHAR(10) NOT NULL,
+    sink VARCHAR(10) NOT NULL,
+    time VARCHAR(10) NOT NULL,
+    resolution VARCHAR(10) NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    leased_until TIMESTAMP WITH TIME ZONE,
+    worker VARCHAR(100),
+    last_error TEXT,
+    enqueued_seq BIGSERIAL,
+    UNIQUE (exchange, source, sink, resolution));
+
+-- Queues created before enqueued_seq existed
+ALTER TABLE scrape_queue ADD COLUMN IF NOT EXISTS enqueued_seq BIGSERIAL;
+DROP INDEX IF EXISTS scrape_queue_available_idx;
+
+CREATE INDEX IF NOT EXISTS scrape_queue_available_seq_idx
+    ON scrape_queue (enqueued_seq)
+    WHERE status IN ('pending', 'claimed');
@@ -0,0 +1,39 @@
+-- Migrate an existing exchange_pair_hour table to monthly range partitions
+-- (PostgreSQL 11+). The old table is kept as
+-- exchange_pair_hour_unpartitioned; drop it once the copy is verified.
+-- Set pg.partitioned = True afterwards.
+BEGIN;
+
+ALTER TABLE exchange_pair_hour RENAME TO exchange_pair_hour_unpartitioned;
+
+CREATE TABLE exchange_pair_hour (
+    LIKE exchange_pair_hour_unpartitioned,
+    PRIMARY KEY (exchange, source, sink, hour))
+PARTITION BY RANGE (hour);
+
+CREATE INDEX exchange_pair_hour_hour_brin
+    ON exchange_pair_hour USING BRIN (hour);
+
+DO $$
+DECLARE
+    month TIMESTAMP;
+BEGIN
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', min(hour)), max(hour), interval '1 month')
+        FROM exchange_pair_hour_unpartitioned
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF exchange_pair_hour '
+            'FOR VALUES FROM (%L) TO (%L)',
+            'exchange_pair_hour_p' || to_char(month, 'YYYYMM'),
+            month, month + interval '1 month');
+    END LOOP;
+END $$;
+
+INSERT INTO exchange_pair_hour
+SELECT * FROM exchange_pair_hour_unpartitioned;
+
+ANALYZE exchange_pair_hour;
+
+COMMIT;
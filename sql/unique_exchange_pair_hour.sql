@@ -0,0 +1,17 @@
+-- Migrate an existing exchange_pair_hour table to the unique key required by
+-- the COPY / ON CONFLICT loader (PostgreSQL 9.5+).
+BEGIN;
+
+DELETE FROM exchange_pair_hour AS a
+USING exchange_pair_hour AS b
+WHERE a.exchange = b.exchange
+AND a.source = b.source
+AND a.sink = b.sink
+AND a.hour = b.hour
+AND a.ctid < b.ctid;
+
+DROP INDEX IF EXISTS exchange_pair_hour_exchange_source_sink_hour_idx;
+CREATE UNIQUE INDEX exchange_pair_hour_exchange_source_sink_hour_idx
+    ON exchange_pair_hour (exchange, source, sink, hour);
+
+COMMIT;
@@ -0,0 +1,266 @@
+"""Postgres-backed work queue for scraping pairs from several workers.
+
+A coordinator enqueues one job per price / volume request. Workers on any
+host claim batches with FOR UPDATE SKIP LOCKED, so no job is handed out
+twice, and hold a lease on them while they fetch, parse and load. A job
+whose lease expires, because its worker died, is claimed again; failed
+jobs are retried with a growing delay until maxAttempts. Every worker
+process throttles its own requests through cryptocoincharts' token
+buckets.
+"""
+import cryptocoincharts
+import logging
+import os
+import pg
+import pipeline
+import psycopg2 as pg2
+import psycopg2.extras as pg2ext
+import socket
+import threading
+import time
+import unittest
+
+# Configuration variables
+queueTable = "scrape_queue"
+leaseSeconds = 600
+maxAttempts = 5
+retryDelaySeconds = 60
+claimBatchSize = 16
+idleSleepSeconds = 10
+
+jobColumns = ["id", "exchange", "source", "sink", "time", "resolution"]
+
+
+class WorkQueue(object):
+
+    """Jobs in queueTable, accessed over a dedicated connection.
+
+    The connection is separate from pg's, so queue updates never commit
+    or roll back a load in progress.
+    """
+
+    def __init__(self, worker=None):
+        """Connect and name this worker."""
+        self.worker = worker or "{0}:{1}".format(
+            socket.gethostname(), os.getpid())
+        self.conn = pg2.connect(**pg.connectionParams())
+        self.lock = threading.Lock()
+
+    def _execute(self, query, params=None):
+        """Private method running one statement in its own transaction."""
+        with self.lock:
+            cursor = self.conn.cursor(cursor_factory=pg2ext.RealDictCursor)
+            try:
+                cursor.execute(query.format(queueTable), params)
+                rows = cursor.fetchall() if cursor.description else None
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            return rows
+
+    def enqueue(self, paramsList):
+        """Add requestPriceVolume argument tuples as pending jobs.
+
+        A job already queued for the same pair and resolution is reset to
+        pending with the new time window unless it is currently claimed.
+        Jobs are claimed in the order they were last enqueued, so
+        paramsList should be sorted by priority.
+        """
+        for source, sink, exchange, time, resolution in paramsList:
+            self._execute("""
+                INSERT INTO {0} AS q
+                    (exchange, source, sink, time, resolution)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (exchange, source, sink, resolution)
+                DO UPDATE SET time = EXCLUDED.time, status = 'pending',
+                    attempts = 0, leased_until = NULL, worker = NULL,
+                    last_error = NULL, enqueued_seq = DEFAULT
+                WHERE q.status <> 'claimed' OR q.leased_until < now()""",
+                (exchange, source, sink, time, resolution))
+        return len(paramsList)
+
+    def claim(self, batchSize=None):
+        """Lease up to batchSize available jobs for this worker."""
+        # Jobs whose last lease ran out on the final attempt have failed
+        self._execute("""
+            UPDATE {0}
+            SET status = 'failed', last_error = 'lease expired'
+            WHERE status = 'claimed'
+            AND leased_until < now()
+            AND attempts >= %s""", (maxAttempts,))
+        return self._execute("""
+            UPDATE {0}
+            SET status = 'claimed',
+                worker = %s,
+                attempts = attempts + 1,
+                leased_until = now() + %s * interval '1 second'
+            WHERE id IN (
+                SELECT id
+                FROM {0}
+                WHERE status IN ('pending', 'claimed')
+                AND (leased_until IS NULL OR leased_until < now())
+                ORDER BY enqueued_seq
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED)
+            RETURNING """ + ", ".join(jobColumns),
+            (self.worker, leaseSeconds, batchSize or claimBatchSize))
+
+    def complete(self, job):
+        """Mark a job done if this worker still holds its lease."""
+        self._execute("""
+            UPDATE {0}
+            SET status = 'done', leased_until = NULL, last_error = NULL
+            WHERE id = %s AND worker = %s AND status = 'claimed'""",
+            (job["id"], self.worker))
+
+    def fail(self, job, error):
+        """Release a job for a delayed retry, or fail it for good."""
+        self._execute("""
+            UPDATE {0}
+            SET status = CASE WHEN attempts >= %s
+                    THEN 'failed' ELSE 'pending' END,
+                leased_until = now() + attempts * %s * interval '1 second',
+                last_error = %s
+            WHERE id = %s AND worker = %s AND status = 'claimed'""",
+            (maxAttempts, retryDelaySeconds, str(error), job["id"],
+             self.worker))
+
+    def counts(self):
+        """Return the number of jobs per status."""
+        return dict(
+            (row["status"], row["jobs"]) for row in self._execute("""
+                SELECT status, count(*) AS jobs
+                FROM {0}
+                GROUP BY status"""))
+
+    def close(self):
+        """Close the queue connection."""
+        self.conn.close()
+
+
+def jobParams(job):
+    """Return the requestPriceVolume arguments of a claimed job."""
+    return (job["source"], job["sink"], job["exchange"], job["time"],
+            job["resolution"])
+
+
+def _guarded(workQueue, func):
+    """Private method failing a job when a stage raises for it."""
+    def stage(item):
+        try:
+            return func(item)
+        except Exception as e:
+            logging.warning("Job {0} failed: {1}".format(item[0]["id"], e))
+            workQueue.fail(item[0], e)
+            return None
+    return stage
+
+
+def runWorker(workQueue, responseArchive=None, fetchWorkers=None,
+              loadWorkers=None, batchSize=None, exitWhenIdle=False):
+    """Claim, fetch, archive, parse and load jobs until stopped.
+
+    Returns the number of completed jobs once the queue is empty if
+    exitWhenIdle is set, otherwise runs forever.
+    """
+    completed = [0]
+    completedLock = threading.Lock()
+
+    def fetchStage(item):
+        job = item[0]
+        return job, cryptocoincharts.requestPriceVolume(*jobParams(job))
+
+    def archiveStage(item):
+        job, priceVolumeJsonDump = item
+        if responseArchive is not None:
+            responseArchive.put(
+                priceVolumeJsonDump,
+                "price_volume_{0}".format("_".join(jobParams(job))),
+                "json"
+            )
+        return item
+
+    def parseStage(item):
+        job, priceVolumeJsonDump = item
+        return job, cryptocoincharts.parsePriceVolume(
+            priceVolumeJsonDump, job["source"], job["sink"], job["exchange"])
+
+    def loadStage(item):
+        job, priceVolume = item
+        pg.loadPriceVolume(priceVolume)
+        workQueue.complete(job)
+        with completedLock:
+            completed[0] += 1
+
+    while True:
+        jobs = workQueue.claim(batchSize)
+        if not jobs:
+            if exitWhenIdle:
+                return completed[0]
+            time.sleep(idleSleepSeconds)
+            continue
+        logging.info("Worker {0} claimed {1} jobs.".format(
+            workQueue.worker, len(jobs)))
+
+        # Each load worker borrows one of pg's pooled connections
+        workerPipeline = pipeline.Pipeline([
+            pipeline.Stage("fetch", _guarded(workQueue, fetchStage),
+                           fetchWorkers or cryptocoincharts.maxInFlight),
+            pipeline.Stage("archive", _guarded(workQueue, archiveStage)),
+            pipeline.Stage("parse", _guarded(workQueue, parseStage)),
+            pipeline.Stage("load", _guarded(workQueue, loadStage),
+                           loadWorkers or pg.poolSize)
+        ])
+        pipeline.logStats(workerPipeline.run((job,) for job in jobs))
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    """Testing suite for workqueue module."""
+
+    def setUp(self):
+        """Create a scratch queue table."""
+        global queueTable
+        self.queueTableOriginal = queueTable
+        queueTable = "{0}_test".format(self.queueTableOriginal)
+        self.workQueue = WorkQueue("test")
+        self.workQueue._execute("""CREATE TABLE IF NOT EXISTS
+            {{0}} (LIKE {0} INCLUDING ALL)""".format(
+            self.queueTableOriginal))
+
+    def tearDown(self):
+        """Drop the scratch queue table."""
+        global queueTable
+        self.workQueue._execute("DROP TABLE IF EXISTS {0}")
+        self.workQueue.close()
+        queueTable = self.queueTableOriginal
+
+    def testClaim(self):
+        """Test jobs are claimed once, completed and retried."""
+        self.workQueue.enqueue([
+            ("usd", "btc", "btc-e", "10d", "1h"),
+            ("usd", "ltc", "btc-e", "10d", "1h"),
+            ("usd", "btc", "btc-e", "alltime", "1d")])
+        # Enqueueing again moves a job to the back of the queue
+        self.workQueue.enqueue([("usd", "btc", "btc-e", "3d", "1h")])
+        other = WorkQueue("other")
+        try:
+            first = self.workQueue.claim(2)
+            self.assertEqual([(job["sink"], job["resolution"])
+                              for job in first],
+                             [("ltc", "1h"), ("btc", "1d")])
+            second = other.claim(2)
+            self.assertEqual(len(second), 1)
+            self.assertEqual(other.claim(2), [])
+            self.workQueue.complete(first[0])
+            self.workQueue.fail(first[1], "timeout")
+            # Another worker cannot complete a job it does not hold
+            other.complete(first[1])
+            self.assertEqual(self.workQueue.counts(), {
+                "done": 1, "pending": 1, "claimed": 1})
+        finally:
+            other.close()
+
+if __name__ == "__main__":
+    unittest.main()